@@ -0,0 +1,110 @@
+"""
+Compare the vectorized name and cost transformations of the results analysis with the row wise apply they replaced.
+
+Builds a synthetic pod frame (the pods of the TeaStore services on three nodes, one row per pod and sample) and times
+every transformation both ways, checking that both give the same result. The row wise apply(axis=1) of the cost
+functions takes minutes on 10M rows, it is timed on --sample rows and extrapolated to the frame.
+
+    python -m clue_deployer.benchmark_results_analysis [--rows 10000000] [--sample 200000]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from clue_deployer.src.results.data_analysis import DataAnalysis
+from clue_deployer.src.results.experiment_results import map_names
+
+SERVICES = ["teastore-webui", "teastore-auth", "teastore-image", "teastore-recommender", "teastore-persistence",
+            "teastore-registry", "teastore-db", "teastore-all", "auth"]
+NODE_MEMORY = {"sm-gpu": 32704316 // 1024, "ise-knode6": 32719632 // 1024, "ise-knode1": 32761604 // 1024}
+
+
+def pod_frame(rows: int, pods_per_service: int = 40) -> pd.DataFrame:
+    """rows samples of the pods of all services, pods are restarted and rescaled so names repeat but are not all alike."""
+    rng = np.random.default_rng(42)
+    names = pd.Series([
+        f"{service}-{rng.integers(16**9):09x}-{rng.integers(10**5):05d}"
+        for service in SERVICES for _ in range(pods_per_service)
+    ])
+    instances = pd.Series(list(NODE_MEMORY))
+    return pd.DataFrame({
+        "name": names[rng.integers(len(names), size=rows)].reset_index(drop=True),
+        "instance": instances[rng.integers(len(instances), size=rows)].reset_index(drop=True),
+        "cpu_usage": rng.random(rows) * 4,
+        "memory_usage": rng.random(rows),
+        "wattage_kepler": rng.random(rows) * 50,
+    })
+
+
+# the row wise implementations before the vectorization
+def name_prefix_apply(pods):
+    return pods["name"].apply(lambda n: n.split("-")[:-1])
+
+
+def pod_name_apply(pods):
+    return pods["name"].apply(lambda x: x[:-2])
+
+
+def service_apply(pods):
+    return pods["name"].apply(lambda x: "-".join(x.split("-")[0:2]))
+
+
+def memory_usage_apply(pods):
+    return pods.apply(lambda row: row["memory_usage"] * NODE_MEMORY[row["instance"]], axis=1)
+
+
+def cost_apply(pods):
+    return pods.apply(
+        lambda row: row["memory_usage"] * DataAnalysis.memory_second_price + np.ceil(row["cpu_usage"]) * DataAnalysis.vCPU_second_price
+        + row["wattage_kepler"] * DataAnalysis.ws_price,
+        axis=1,
+    )
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="rows of the synthetic pod frame")
+    parser.add_argument("--sample", type=int, default=200_000, help="rows the row wise apply(axis=1) is timed on")
+    args = parser.parse_args()
+
+    pods = pod_frame(args.rows)
+    sample = pods.head(args.sample)
+    analysis = DataAnalysis.__new__(DataAnalysis)
+    analysis.node_model = NODE_MEMORY
+
+    cases = [
+        # (name, row wise, vectorized, row wise is timed on the sample)
+        ("load_pods name_prefix", name_prefix_apply, lambda p: map_names(p["name"], lambda n: n.str.split("-").str[:-1]), False),
+        ("load_pod_scaling pod_name", pod_name_apply, lambda p: map_names(p["name"], lambda n: n.str[:-2]), False),
+        ("service names", service_apply, lambda p: DataAnalysis.service_names(p["name"]), False),
+        ("calculate_memory_usage", memory_usage_apply, analysis.calculate_memory_usage, True),
+        ("calculate_cost", cost_apply, DataAnalysis.calculate_cost, True),
+    ]
+    print(f"{args.rows:,} pod rows, {pods['name'].nunique()} pod names")
+    print(f"{'':<28} {'apply s':>9} {'vectorized s':>12} {'speedup':>8}")
+    for name, row_wise, vectorized, sampled in cases:
+        new, new_time = timed(vectorized, pods)
+        if sampled:
+            old, old_time = timed(row_wise, sample)
+            old_time *= len(pods) / len(sample)
+        else:
+            old, old_time = timed(row_wise, pods)
+        # only the compared rows are kept, two columns of 10M lists do not fit into every memory
+        compared = len(old) if sampled else args.sample
+        pd.testing.assert_series_equal(
+            old.head(compared).reset_index(drop=True), new.head(compared).reset_index(drop=True),
+            check_names=False, check_dtype=False,
+        )
+        del old, new
+        note = " (extrapolated)" if sampled else ""
+        print(f"{name:<28} {old_time:>9.2f} {new_time:>12.2f} {old_time / new_time:>7.1f}x{note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compare the gzip and zstd results archives of the loadgenerator for a 30 minute shaped run.
+
+Generates the locust CSVs of a full-history run (one row per endpoint and second), archives them with the
+pipeline of the loadgenerator entrypoint and extracts them with the streaming extractor of the deployer.
+The streamed time is measured: the archive command writes into a pipe that the deployer extracts from while
+it is running, like the log stream of the loadgenerator pod. The transfer time over the cluster network is
+not measured, it is estimated from the archive size and --bandwidth.
+
+    python -m clue_deployer.benchmark_results_archive [--minutes 30] [--endpoints 20] [--bandwidth 100]
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from clue_deployer.src.results_archive import ArchiveStream, extract_archive
+
+SUT = "teastore"
+HISTORY_HEADER = "Timestamp,User Count,Type,Name,Requests/s,Failures/s,50%,66%,75%,80%,90%,95%,98%,99%,99.9%,99.99%,100%,Total Request Count,Total Failure Count,Total Median Response Time,Total Average Response Time,Total Min Response Time,Total Max Response Time,Total Average Content Size"
+STATS_HEADER = "Type,Name,Request Count,Failure Count,Median Response Time,Average Response Time,Min Response Time,Max Response Time,Average Content Size,Requests/s,Failures/s,50%,66%,75%,80%,90%,95%,98%,99%,99.9%,99.99%,100%"
+# the archive command of clue_loadgenerator/workload_generator/entrypoint.sh
+ARCHIVE = {
+    "gzip": "tar zcf - {files} | base64 -w 0",
+    "zstd": "tar cf - {files} | zstd -q -c -10 -T0 | base64 -w 0",
+}
+CHUNK_SIZE = 1024 * 1024
+
+
+def write_run(directory: str, minutes: int, endpoints: int):
+    """The locust CSVs of a shaped run, the user count changes every stage like the daily load shape."""
+    names = [f"/tools.descartes.teastore.webui/endpoint{i}" for i in range(endpoints)] + ["Aggregated"]
+    start = int(time.time())
+    totals = {name: 0 for name in names}
+    with open(os.path.join(directory, f"{SUT}_stats_history.csv"), "w") as f:
+        f.write(HISTORY_HEADER + "\n")
+        for second in range(minutes * 60):
+            users = [2, 5, 8, 6, 6, 5, 1, 1][(second // 225) % 8] * 10
+            for name in names:
+                rps = round(random.uniform(0.5, 1.5) * users / 4, 2)
+                totals[name] += int(rps)
+                percentiles = sorted(random.randint(5, 400) for _ in range(11))
+                f.write(",".join(map(str, [
+                    start + second, users, "GET" if name != "Aggregated" else "", name, rps, 0.0, *percentiles,
+                    totals[name], 0, percentiles[0], round(random.uniform(10, 80), 6), 3, percentiles[-1], round(random.uniform(900, 5000), 6),
+                ])) + "\n")
+    with open(os.path.join(directory, f"{SUT}_stats.csv"), "w") as f:
+        f.write(STATS_HEADER + "\n")
+        for name in names:
+            f.write(f"GET,{name},{totals[name]},0,40,42.1,3,400,2048.0,1.2,0.0" + ",40" * 11 + "\n")
+    with open(os.path.join(directory, f"{SUT}_failures.csv"), "w") as f:
+        f.write("Method,Name,Error,Occurrences\n")
+    open(os.path.join(directory, "errors.log"), "w").close()
+
+
+def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=int, default=30, help="duration of the shaped run")
+    parser.add_argument("--endpoints", type=int, default=20, help="number of endpoints in the history")
+    parser.add_argument("--bandwidth", type=float, default=100, help="log stream bandwidth in Mbit/s of the transfer estimate (not measured)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="clue-archive-")
+    try:
+        source = os.path.join(workdir, "run")
+        os.makedirs(source)
+        write_run(source, args.minutes, args.endpoints)
+        files = sorted(os.listdir(source))
+        raw_size = sum(os.path.getsize(os.path.join(source, name)) for name in files)
+        print(f"{args.minutes} minute run, {len(files)} files, {raw_size / 1e6:.1f} MB")
+        print(f"{'codec':<6} {'archive MB':>10} {'ratio':>6} {'archive s':>10} {'extract s':>10} {'streamed s':>11} {'est. transfer s':>16}")
+
+        for codec, command in ARCHIVE.items():
+            if shutil.which(codec) is None and codec != "gzip":
+                print(f"{codec:<6} skipped, {codec} is not installed")
+                continue
+            start = time.perf_counter()
+            encoded = subprocess.run(["bash", "-c", command.format(files=" ".join(files))], cwd=source, check=True, capture_output=True).stdout
+            archive_time = time.perf_counter() - start
+
+            target = os.path.join(workdir, codec)
+            os.makedirs(target)
+            start = time.perf_counter()
+            extract_archive(ArchiveStream(chunks(encoded, CHUNK_SIZE)), target)
+            extract_time = time.perf_counter() - start
+            assert sorted(os.listdir(target)) == files
+
+            # archive, pipe and extract at once, the chunks are extracted while the archive is still written
+            target = os.path.join(workdir, f"{codec}-streamed")
+            os.makedirs(target)
+            start = time.perf_counter()
+            with subprocess.Popen(["bash", "-c", command.format(files=" ".join(files))], cwd=source, stdout=subprocess.PIPE) as archiver:
+                extract_archive(ArchiveStream(iter(lambda: archiver.stdout.read(CHUNK_SIZE), b"")), target)
+            streamed_time = time.perf_counter() - start
+            assert archiver.returncode == 0 and sorted(os.listdir(target)) == files
+
+            transfer_time = len(encoded) * 8 / (args.bandwidth * 1e6)
+            print(f"{codec:<6} {len(encoded) / 1e6:>10.2f} {raw_size / len(encoded):>6.1f} {archive_time:>10.2f} {extract_time:>10.2f} {streamed_time:>11.2f} {transfer_time:>16.2f}")
+        print(f"est. transfer s: archive size at {args.bandwidth:g} Mbit/s, a bandwidth model, not a measured transfer")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
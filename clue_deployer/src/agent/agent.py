@@ -3,7 +3,9 @@ from io import StringIO ## for Python 3
 from flask import Flask,Response, request
 from flask_sock import Sock
 import csv
+import json
 import os
+import time
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +22,18 @@ if "UPDATE_INTERVAL" in os.environ:
 else:
     UPDATE_INTERVAL = 30
 
+CONCURRENT_QUERIES = os.environ.get("CONCURRENT_QUERIES", "false").lower() == "true"
+WATCH_PODS = os.environ.get("WATCH_PODS", "false").lower() == "true"
+FILTER_SCAPHANDRE = os.environ.get("FILTER_SCAPHANDRE", "false").lower() == "true"
+# comma separated metric sources that are not deployed, e.g. "tapo,temperature"
+DISABLED_SOURCES = [source for source in os.environ.get("DISABLED_SOURCES", "").split(",") if source]
+# read the clue:* series of the recording rules (psc/recording_rules.py) where they exist
+RECORDING_RULES = os.environ.get("RECORDING_RULES", "false").lower() == "true"
+# seconds a batched stream waits for more rows of the same tick before sending a frame
+STREAM_LINGER = float(os.environ.get("STREAM_LINGER", "0.1"))
+# seconds a batched stream waits for new rows before checking again
+STREAM_TIMEOUT = float(os.environ.get("STREAM_TIMEOUT", "5"))
+
 
 namespace = None
 if os.path.exists("/var/run/secrets/kubernetes.io/serviceaccount/namespace"):
@@ -30,22 +44,41 @@ elif os.environ.get("NAMESPACE"):
 else:
     namespace = "default"
     
-from psc import ResourceTracker, FixedQueue, NodeUsage, PodUsage
+from psc import ResourceTracker, FixedQueue, NodeUsage, PodUsage, Exposition, OPENMETRICS_CONTENT_TYPE, TEXT_CONTENT_TYPE
 
 logger.info("Using namespace %s", namespace)
 node_channel = FixedQueue(1024)
 pod_channel = FixedQueue(8192)
-rt = ResourceTracker(url, node_channel,pod_channel, [namespace], UPDATE_INTERVAL)
-rt.start()
+rt = None
+
+def start_tracker():
+    """Start the resource tracker that fills the channels, gunicorn starts it once the worker is ready (see gunicorn.conf.py)."""
+    global rt
+    if rt is not None:
+        return rt
+    rt = ResourceTracker(url, node_channel,pod_channel, [namespace], UPDATE_INTERVAL, concurrent_queries=CONCURRENT_QUERIES, watch_pods=WATCH_PODS, filter_scaphandre=FILTER_SCAPHANDRE, metrics={"sources": {source: False for source in DISABLED_SOURCES}}, recording_rules=RECORDING_RULES)
+    rt.start()
+    return rt
+
+def stop_tracker():
+    if rt is not None:
+        rt.stop()
 
 app = Flask(f"Prometheus Resource Tracker {namespace}")
 sock = Sock(app)
 logging.basicConfig(level=logging.ERROR)
 
-def write_csv(channel, size, fields=NodeUsage._fields):
+def write_csv(channel, size, fields=NodeUsage._fields, since=None):
     size = min(size, channel.maxsize)
-    data = channel.take(size)
-    
+    headers = {"Content-disposition": "attachment; filename=metrics.csv"}
+    if since is None:
+        # the newest rows, reading does not remove them for other clients
+        data = channel.latest(size)
+    else:
+        # the next request continues from X-Cursor
+        cursor, data = channel.since(since, size)
+        headers["X-Cursor"] = str(cursor)
+
     raw = StringIO()
     writer = csv.DictWriter(raw, fieldnames=fields)
     writer.writeheader()
@@ -55,40 +88,110 @@ def write_csv(channel, size, fields=NodeUsage._fields):
     return Response(
         raw.getvalue(),
         mimetype="text/csv",
-        headers={"Content-disposition":
-                    "attachment; filename=metrics.csv"}) 
+        headers=headers)
 
 def sent_csv(websocet, channel, fields=NodeUsage._fields):
+    # a live stream, the rows before the client connected are not replayed (only the ndjson stream resumes from a cursor)
+    reader = channel.reader(channel.last_seq)
     websocet.send(','.join(fields))
-    while True:
-        p = channel.get().to_dict()
+    while websocet.connected:
+        p = reader.get(timeout=STREAM_TIMEOUT)
+        if p is None:
+            continue
+        p = p.to_dict()
         websocet.send( ','.join([str(p[f]) for f in fields if f in p]))
 
+class EncodedRows:
+    """
+    The NDJSON lines of the rows of a channel by sequence number, every row is encoded once for all streams.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self._lines = [None] * channel.maxsize
+
+    def lines(self, last, rows):
+        lines = []
+        for seq, p in enumerate(rows, last - len(rows) + 1):
+            slot = (seq - 1) % self.channel.maxsize
+            cached = self._lines[slot]
+            if cached is None or cached[0] != seq:
+                cached = (seq, json.dumps(p.to_row(), default=str))
+                self._lines[slot] = cached
+            lines.append(cached[1])
+        return lines
+
+node_lines = EncodedRows(node_channel)
+pod_lines = EncodedRows(pod_channel)
+
+def sent_ndjson(websocet, channel, fields=NodeUsage._fields, batch=500, cursor=0):
+    """
+    Stream the rows after cursor in frames of up to batch rows. The first message is {"fields": [...], "cursor": ...},
+    every frame starts with {"first": ..., "last": ...} followed by one JSON array per row in the order of fields.
+    A client resumes with since=<last> of the last frame it received, first > last + 1 marks dropped rows.
+    A slow client only delays its own frames, it never blocks the tracker or other clients.
+    """
+    batch = max(1, min(batch, channel.maxsize))
+    encoded = node_lines if channel is node_channel else pod_lines
+    websocet.send(json.dumps({"fields": fields, "cursor": cursor}))
+    reader = channel.reader(cursor)
+    while websocet.connected:
+        if not reader.wait(STREAM_TIMEOUT):
+            continue
+        if STREAM_LINGER > 0 and channel.last_seq - reader.cursor < batch:
+            # the tracker puts the rows of a tick one by one, collect them into one frame
+            time.sleep(STREAM_LINGER)
+        dropped = reader.dropped
+        rows = reader.read(batch)
+        if not rows:
+            continue
+        if reader.dropped > dropped:
+            logger.warning("Stream fell behind, %d rows were dropped", reader.dropped - dropped)
+        frame = [json.dumps({"first": reader.cursor - len(rows) + 1, "last": reader.cursor})]
+        frame += encoded.lines(reader.cursor, rows)
+        websocet.send("\n".join(frame))
+
+def stream(websocet, channel, fields):
+    args = request.args
+    if args.get("format", default="csv") == "ndjson":
+        sent_ndjson(websocet, channel, fields, args.get("batch", default=500, type=int), args.get("since", default=0, type=int))
+    else:
+        sent_csv(websocet, channel, fields)
+
 @app.route('/download', strict_slashes=False)
 @app.route('/nodes', strict_slashes=False)
 def download_nodes():
     args = request.args
     size = args.get("size", default=90, type=int)
-    return write_csv(node_channel, size)
+    return write_csv(node_channel, size, since=args.get("since", type=int))
 
 @app.route('/pods', strict_slashes=False)
 def download_pods():
     args = request.args
     size = args.get("size", default=90, type=int)
-    return write_csv(pod_channel, size, PodUsage._fields)
+    return write_csv(pod_channel, size, PodUsage._fields, since=args.get("since", type=int))
+
+
+exposition = Exposition(lambda: rt.last_samples if rt is not None else None)
 
+@app.route('/metrics', strict_slashes=False)
+def scrape():
+    # websocket requests to /metrics are routed to stream_nodes
+    openmetrics = "application/openmetrics-text" in request.headers.get("Accept", "")
+    return Response(exposition.body(openmetrics), content_type=OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE)
 
 @sock.route('/metrics', strict_slashes=False)
 @sock.route('/metrics/nodes', strict_slashes=False)
 def stream_nodes(ws):
-    sent_csv(ws, node_channel)
+    stream(ws, node_channel, NodeUsage._fields)
 
 @sock.route('/metrics/pods', strict_slashes=False)
 def steam_pods(ws):
-    sent_csv(ws, pod_channel, PodUsage._fields)
+    stream(ws, pod_channel, PodUsage._fields)
 
 def main():
+    # development server with a thread per client, deployments run gunicorn -c gunicorn.conf.py agent:app
     logging.basicConfig(level=logging.ERROR)
+    start_tracker()
     app.run(host='0.0.0.0', port=80)
 
 
@@ -0,0 +1,25 @@
+import os
+
+# gunicorn -c gunicorn.conf.py agent:app
+#
+# The gevent worker serves every request and websocket in a greenlet, a streaming client waiting for rows does not hold an OS thread.
+# The tracker and the ring buffers live in the worker process, so a single worker serves all clients.
+bind = os.environ.get("AGENT_BIND", "0.0.0.0:8000")
+workers = 1
+worker_class = os.environ.get("AGENT_WORKER_CLASS", "gevent")
+# maximum number of concurrent clients (downloads and streams) of the gevent worker
+worker_connections = int(os.environ.get("AGENT_MAX_CLIENTS", "1000"))
+# streams are open for the whole experiment
+timeout = 0
+graceful_timeout = 0
+
+
+def post_worker_init(worker):
+    # the tracker runs as a background task of the worker, after gevent patched threading and sockets
+    import agent
+    agent.start_tracker()
+
+
+def worker_exit(server, worker):
+    import agent
+    agent.stop_tracker()
@@ -0,0 +1,240 @@
+"""
+Load test of the agent's streaming endpoint, how many concurrent /metrics/pods subscribers a single agent sustains.
+
+Starts the agent with gunicorn and gunicorn.conf.py but without Prometheus: a synthetic tracker puts the rows of
+--pods pods every --interval seconds into the pod channel. For every client count the clients subscribe to
+/metrics/pods?format=ndjson, count the rows they receive and measure the delay between a tick and its frame.
+A client count is sustained if every client receives all rows (none dropped because it fell behind) and the p99 delay
+stays below the interval. delivered is the share of rows the worst client received.
+
+    python load_test.py [--clients 100,500,1000] [--pods 200] [--interval 1] [--duration 20] [--worker-class gevent]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+# the tracker imports clue_deployer.src.logger
+REPO_ROOT = os.path.abspath(os.path.join(AGENT_DIR, "..", "..", ".."))
+
+
+def synthetic_app():
+    """The agent app with a synthetic tracker, gunicorn loads it with load_test:synthetic_app()."""
+    import agent
+    from psc import PodUsage
+
+    pods = int(os.environ["LOAD_TEST_PODS"])
+    interval = float(os.environ["LOAD_TEST_INTERVAL"])
+
+    def track():
+        while True:
+            now = time.time()
+            for i in range(pods):
+                p = PodUsage()
+                p.collection_time = now
+                p.observation_time = now
+                p.name = f"teastore-webui-{i:05d}"
+                p.namespace = agent.namespace
+                p.instance = f"node-{i % 4}"
+                p.cpu_usage = random.random()
+                p.memory_usage = random.random() * 8000
+                p.network_usage = random.random()
+                p.kepler_consumtion = random.random() * 100
+                p.scaphandre_consumtion = random.random() * 100
+                p.interval = interval
+                agent.pod_channel.put(p)
+            time.sleep(max(0.0, interval - (time.time() - now)))
+
+    threading.Thread(target=track, daemon=True, name="synthetic-tracker").start()
+    return agent.app
+
+
+class ClientStats:
+    __slots__ = ("rows", "first", "last", "delays", "error")
+
+    def __init__(self):
+        self.rows = 0
+        # sequence numbers of the first and last measured row, rows in between that were not received were dropped
+        self.first = None
+        self.last = None
+        self.delays = []
+        self.error = None
+
+    def delivered(self):
+        return self.rows / (self.last - self.first + 1) if self.rows else 0.0
+
+
+def subscribe(url, start, end, stats):
+    import simple_websocket
+    try:
+        ws = simple_websocket.Client.connect(url)
+    except Exception as e:
+        stats.error = str(e)
+        return
+    try:
+        json.loads(ws.receive())  # {"fields": [...], "cursor": ...}
+        while time.time() < end:
+            frame = ws.receive(timeout=1)
+            if frame is None:
+                continue
+            now = time.time()
+            lines = frame.split("\n")
+            head = json.loads(lines[0])
+            # the first frame holds the retained rows of earlier ticks
+            if now < start:
+                continue
+            # collection_time is the first field of the pod rows
+            collected = datetime.fromisoformat(json.loads(lines[-1])[0]).timestamp()
+            stats.rows += head["last"] - head["first"] + 1
+            stats.first = head["first"] if stats.first is None else stats.first
+            stats.last = head["last"]
+            stats.delays.append(now - collected)
+    except Exception as e:
+        stats.error = str(e)
+    finally:
+        ws.close()
+
+
+def worker_usage(master_pid):
+    """CPU seconds and RSS in MB of the gunicorn worker (the only child of the master), None if not readable."""
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            pid = int(f.read().split()[0])
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+        return (int(stat[11]) + int(stat[12])) / os.sysconf("SC_CLK_TCK"), rss / 1024
+    except (OSError, IndexError, StopIteration, ValueError):
+        return None
+
+
+def start_agent(port, args, max_clients):
+    env = dict(os.environ)
+    env.update({
+        "AGENT_BIND": f"127.0.0.1:{port}",
+        "AGENT_WORKER_CLASS": args.worker_class,
+        "AGENT_MAX_CLIENTS": str(max_clients + 16),
+        "PROMETHEUSSERVER": "",
+        "NAMESPACE": "load-test",
+        "LOAD_TEST_PODS": str(args.pods),
+        "LOAD_TEST_INTERVAL": str(args.interval),
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")])),
+    })
+    agent = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "load_test:synthetic_app()"],
+        cwd=AGENT_DIR, env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return agent
+        except OSError:
+            if agent.poll() is not None:
+                raise RuntimeError(f"The agent exited with {agent.returncode}")
+            time.sleep(0.2)
+    agent.terminate()
+    raise RuntimeError("The agent did not start within 30s")
+
+
+def run_clients(url, start, end, clients):
+    """Subscribe clients in greenlets of this process, prints the stats of every client as JSON lines."""
+    from gevent import monkey
+    monkey.patch_all()
+    import gevent
+
+    stats = [ClientStats() for _ in range(clients)]
+    gevent.joinall([gevent.spawn(subscribe, url, start, end, s) for s in stats], timeout=end - time.time() + 30)
+    for s in stats:
+        print(json.dumps({name: getattr(s, name) for name in ClientStats.__slots__}))
+
+
+def measure(url, start, end, clients, processes):
+    """The client stats of all client processes."""
+    shares = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    runs = [
+        subprocess.Popen([sys.executable, __file__, "--subscribe", url, "--start", str(start), "--end", str(end), "--clients", str(n)],
+                         stdout=subprocess.PIPE, text=True)
+        for n in shares if n
+    ]
+    stats = []
+    for run in runs:
+        out, _ = run.communicate()
+        for line in out.splitlines():
+            s = ClientStats()
+            for name, value in json.loads(line).items():
+                setattr(s, name, value)
+            stats.append(s)
+    for _ in range(clients - len(stats)):
+        s = ClientStats()
+        s.error = "client process failed"
+        stats.append(s)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="100,500,1000", help="comma separated numbers of concurrent subscribers")
+    parser.add_argument("--pods", type=int, default=200, help="pod rows per tick")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between ticks")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per client count")
+    parser.add_argument("--batch", type=int, default=1000, help="rows per frame requested by the clients")
+    parser.add_argument("--worker-class", default="gevent", help="gunicorn worker class of the agent, e.g. gevent or gthread")
+    parser.add_argument("--client-processes", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="processes running the clients, the agent worker needs a core of its own")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--subscribe", help=argparse.SUPPRESS)
+    parser.add_argument("--start", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--end", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.subscribe:
+        run_clients(args.subscribe, args.start, args.end, int(args.clients))
+        return
+    steps = [int(c) for c in args.clients.split(",")]
+
+    agent = start_agent(args.port, args, max(steps))
+    url = f"ws://127.0.0.1:{args.port}/metrics/pods?format=ndjson&batch={args.batch}"
+    expected = args.pods / args.interval
+    print(f"{args.pods} pods every {args.interval}s ({expected:.0f} rows/s per client), {args.worker_class} worker, "
+          f"{args.client_processes} client processes, {args.duration:.0f}s per step")
+    print(f"{'clients':>8} {'connected':>9} {'rows/s':>8} {'delivered':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'agent cpu':>9} {'rss MB':>7}  sustained")
+    try:
+        for clients in steps:
+            # connecting and the first frames with the retained rows are not measured
+            start = time.time() + max(2.0, clients / 200) + 2 * args.interval
+            end = start + args.duration
+            before, measured = worker_usage(agent.pid), time.time()
+            stats = measure(url, start, end, clients, args.client_processes)
+            after, measured = worker_usage(agent.pid), time.time() - measured
+
+            connected = [s for s in stats if s.error is None]
+            delays = sorted(d for s in connected for d in s.delays)
+            rows = sum(s.rows for s in connected) / max(len(connected), 1) / args.duration
+            delivered = min((s.delivered() for s in connected), default=0.0)
+            p50 = statistics.median(delays) * 1000 if delays else float("nan")
+            p99 = delays[int(len(delays) * 0.99)] * 1000 if delays else float("nan")
+            worst = delays[-1] * 1000 if delays else float("nan")
+            # of one core, including connecting the clients
+            cpu = f"{(after[0] - before[0]) / measured:>9.0%}" if before and after else f"{'n/a':>9}"
+            rss = f"{after[1]:>7.0f}" if after else f"{'n/a':>7}"
+            sustained = len(connected) == clients and delivered == 1.0 and p99 < args.interval * 1000
+            print(f"{clients:>8} {len(connected):>9} {rows:>8.0f} {delivered:>9.0%} {p50:>8.0f} {p99:>8.0f} {worst:>8.0f} {cpu:>9} {rss}  {'yes' if sustained else 'no'}")
+            errors = {s.error for s in stats if s.error}
+            if errors:
+                print(f"         errors: {', '.join(sorted(errors)[:3])}")
+    finally:
+        agent.terminate()
+        agent.wait()
+
+
+if __name__ == "__main__":
+    main()
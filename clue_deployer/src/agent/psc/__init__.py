@@ -1 +1,3 @@
-from .tracker import ResourceTracker,FixedQueue,NodeUsage,PodUsage
\ No newline at end of file
+from .tracker import ResourceTracker,NodeUsage,PodUsage
+from .ring_buffer import FixedQueue, Reader
+from .exposition import Exposition, OPENMETRICS_CONTENT_TYPE, TEXT_CONTENT_TYPE
\ No newline at end of file
@@ -0,0 +1,84 @@
+import time
+from clue_deployer.src.logger import logger
+
+
+class AdaptiveInterval:
+    """
+    Sampling interval of the resource tracker that follows the load.
+
+    The interval drops to min_interval while the load shape is changing (announced transitions) or when the
+    summed node cpu usage or wattage changed by more than threshold (relative) since the last tick.
+    During steady state it grows by growth per tick up to max_interval, but never skips an announced transition.
+    """
+
+    # node values compared between ticks
+    SIGNALS = ["cpu_usage", "wattage_kepler", "wattage"]
+    # the workload settings of the stage duration of the shaped workloads, the teastore shapes use the first,
+    # the rampup shapes of toystore and otel-demo the second
+    STAGE_DURATION_SETTINGS = ["LOADGENERATOR_STAGE_DURATION", "STAGE_DURATION"]
+
+    def __init__(self, min_interval: float, max_interval: float, threshold: float = 0.2, growth: float = 2.0):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError(f"Invalid adaptive interval bounds {min_interval} - {max_interval}")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self.growth = growth
+        self.interval = min_interval
+        self._transitions = []  # (start, end) epoch seconds
+        self._last = None
+
+    def add_transition(self, start: float, end: float = None):
+        """Announce a change of the load shape between start and end (epoch seconds)."""
+        self._transitions.append((start, end if end is not None else start))
+        self._transitions.sort()
+
+    def announce_load_shape(self, start: float, settings: dict, runtime: float):
+        """
+        Announce the phases of the load shape of a workload started at start (epoch seconds): the ramp-up of the
+        users and the stage changes of the shaped workloads within runtime seconds.
+        """
+        users, spawn_rate = settings.get("LOCUST_USERS"), settings.get("LOCUST_SPAWN_RATE")
+        if users and spawn_rate:
+            self.add_transition(start, start + float(users) / float(spawn_rate))
+        stage_duration = next((settings[key] for key in self.STAGE_DURATION_SETTINGS if settings.get(key)), None)
+        if stage_duration:
+            stage_duration = float(stage_duration)
+            for i in range(1, int(runtime // stage_duration) + 1):
+                at = start + i * stage_duration
+                self.add_transition(at, at + self.min_interval)
+
+    def _changing(self, now: float):
+        return any(start <= now <= end for start, end in self._transitions)
+
+    def _next_transition(self, now: float):
+        return next((start for start, _ in self._transitions if start > now), None)
+
+    def _deltas(self, nodes: list):
+        current = {signal: sum(getattr(n, signal) or 0 for n in nodes) for signal in self.SIGNALS}
+        last, self._last = self._last, current
+        if last is None:
+            return {}
+        return {
+            signal: abs(current[signal] - last[signal]) / abs(last[signal])
+            for signal in self.SIGNALS if last[signal]
+        }
+
+    def next(self, nodes: list, now: float = None):
+        """Compute the interval until the next tick from the node samples of the current tick."""
+        now = now if now is not None else time.time()
+        deltas = self._deltas(nodes)
+        changed = [signal for signal, delta in deltas.items() if delta > self.threshold]
+        if self._changing(now):
+            interval = self.min_interval
+        elif changed:
+            logger.debug(f"Load changed ({', '.join(f'{s} {deltas[s]:.0%}' for s in changed)}), sampling every {self.min_interval}s")
+            interval = self.min_interval
+        else:
+            interval = min(self.interval * self.growth, self.max_interval)
+        # wake up in time for the next announced transition
+        upcoming = self._next_transition(now)
+        if upcoming is not None:
+            interval = max(self.min_interval, min(interval, upcoming - now))
+        self.interval = interval
+        return interval
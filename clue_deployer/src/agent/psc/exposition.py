@@ -0,0 +1,85 @@
+import math
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+TEXT_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (metric name, sample attribute, help), all metrics are gauges
+NODE_METRICS = [
+    ("clue_node_cpu_usage", "cpu_usage", "CPU seconds per second used on the node"),
+    ("clue_node_memory_usage_ratio", "memory_usage", "Fraction of the node memory in use"),
+    ("clue_node_network_usage", "network_usage", "MB per second sent and received by the node"),
+    ("clue_node_wattage", "wattage", "Watt measured by the Tapo plug of the node"),
+    ("clue_node_pods", "num_processes", "Pods running on the node"),
+    ("clue_node_wattage_kepler", "wattage_kepler", "Watt of the node measured by Kepler"),
+    ("clue_node_wattage_scaph", "wattage_scaph", "Watt of the node measured by Scaphandre"),
+    ("clue_node_wattage_auxilary", "wattage_auxilary", "Watt measured by Scaphandre that is not attributed to a container"),
+    ("clue_node_temperature", "temp", "Maximum thermal zone temperature of the node"),
+]
+POD_METRICS = [
+    ("clue_pod_cpu_usage", "cpu_usage", "CPU seconds per second used by the pod"),
+    ("clue_pod_memory_usage_megabytes", "memory_usage", "Average working set of the pod in MB"),
+    ("clue_pod_network_usage", "network_usage", "MB per second sent and received by the pod"),
+    ("clue_pod_wattage_kepler", "kepler_consumtion", "Watt of the pod measured by Kepler"),
+    ("clue_pod_wattage_scaph", "scaphandre_consumtion", "Watt of the pod containers measured by Scaphandre"),
+]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(value):
+    if isinstance(value, float) and math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _family(lines, name, help, samples):
+    """Append a gauge family, samples are (labels, value) and samples without a value are left out."""
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in samples:
+        # unmeasured values are None, the tapo wattage and pod count of nodes default to -1
+        if value is None or value == -1:
+            continue
+        rendered = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        lines.append(f"{name}{{{rendered}}} {_value(value)}" if rendered else f"{name} {_value(value)}")
+
+
+def render(nodes, pods, openmetrics=True):
+    """The node and pod samples of a tick in the OpenMetrics (or Prometheus text 0.0.4) exposition format."""
+    lines = []
+    collected = max((s.collection_time for s in nodes + pods if s.collection_time is not None), default=None)
+    if collected is not None:
+        _family(lines, "clue_tick_timestamp_seconds", "Collection time of the exposed samples", [({}, collected)])
+    interval = next((s.interval for s in nodes + pods if s.interval is not None), None)
+    _family(lines, "clue_tick_interval_seconds", "Time span the exposed samples represent", [({}, interval)])
+    for name, attribute, help in NODE_METRICS:
+        _family(lines, name, help, [({"instance": n.instance}, getattr(n, attribute)) for n in nodes])
+    for name, attribute, help in POD_METRICS:
+        _family(lines, name, help, [({"namespace": p.namespace, "pod": p.name, "instance": p.instance}, getattr(p, attribute)) for p in pods])
+    if openmetrics:
+        lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode()
+
+
+class Exposition:
+    """
+    The exposition of the last tick of a resource tracker. It is rendered once per tick on the first scrape,
+    scrapes are served from memory without querying Prometheus.
+    """
+
+    def __init__(self, samples):
+        # returns the (nodes, pods) of the last tick, None before the first tick
+        self.samples = samples
+        self._cache = (None, {})
+
+    def body(self, openmetrics=True):
+        samples = self.samples() or ([], [])
+        tick, rendered = self._cache
+        if tick is not samples:
+            tick, rendered = samples, {}
+            self._cache = (tick, rendered)
+        if openmetrics not in rendered:
+            rendered[openmetrics] = render(*samples, openmetrics=openmetrics)
+        return rendered[openmetrics]
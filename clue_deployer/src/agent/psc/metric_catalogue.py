@@ -0,0 +1,219 @@
+import re
+from string import Template
+from clue_deployer.src.logger import logger
+
+
+# The exporters the tracker can query. Required sources raise if their probe metrics are missing,
+# optional sources are disabled and never queried.
+SOURCES = {
+    "node_exporter": {
+        "required": True,
+        "probe": ["node_memory_MemFree_bytes", "node_memory_MemTotal_bytes", "node_cpu_seconds_total", "node_memory_Cached_bytes",
+                  "node_network_receive_bytes_total", "node_network_transmit_bytes_total"],
+    },
+    "cadvisor": {
+        "required": True,
+        "probe": ["container_cpu_usage_seconds_total", "container_memory_working_set_bytes"],
+    },
+    "kepler": {
+        "required": True,
+        "probe": ["kepler_container_joules_total"],
+    },
+    "kubelet": {
+        "required": False,
+        "probe": ["kubelet_working_pods"],
+    },
+    "scaphandre": {
+        "required": False,
+        "probe": ["scaph_host_power_microwatts"],
+    },
+    "tapo": {
+        "required": False,
+        "probe": ["tapo_total_wattage"],
+    },
+    "temperature": {
+        "required": False,
+        "probe": ["node_thermal_zone_temp"],
+    },
+}
+
+# The default metrics, the queries are string.Template templates with the placeholders
+#   $sumby    the node label the node metrics are grouped by
+#   $window   the range of rate and irate
+#   $ns_match the namespace matcher of the pod metrics, e.g. namespace="default" or namespace=~"a|b"
+#   $ns_by    the namespace grouping of batched pod queries, empty for a single namespace
+#   $selector the container id selector of the scaphandre process metric, empty for all processes
+METRICS = {
+    "nodes": {
+        # Memory usage ratio (0 - 1) percentaage
+        "memory": {"source": "node_exporter", "query": "sum by ($sumby) ((1 - ((avg_over_time(node_memory_MemFree_bytes[$window]) + avg_over_time(node_memory_Cached_bytes[$window]) + avg_over_time(node_memory_Buffers_bytes[$window])) / avg_over_time(node_memory_MemTotal_bytes[$window]))))"},
+        # CPU seconds ratio (1 ~ 1 full core used)
+        "cpu": {"source": "node_exporter", "query": 'sum by ($sumby) (rate(node_cpu_seconds_total{mode!="idle"}[$window]))'},
+        # MB/s
+        "network": {"source": "node_exporter", "query": "sum by ($sumby) (rate(node_network_receive_bytes_total[$window])+rate(node_network_transmit_bytes_total[$window]))/1e6"},
+        # Watt
+        "kepler": {"source": "kepler", "query": "sum by ($sumby) (irate(kepler_node_core_joules_total[$window])) + sum by ($sumby) (irate(kepler_node_uncore_joules_total[$window])) +sum by ($sumby) (irate(kepler_node_package_joules_total[$window])) + sum by ($sumby) (irate(kepler_node_dram_joules_total[$window]))"},
+        # Watt
+        "scaphandre": {"source": "scaphandre", "query": "sum by ($sumby) (scaph_host_power_microwatts/1e6)"},
+        "tapo": {"source": "tapo", "query": "tapo_total_wattage"},
+        "pods": {"source": "kubelet", "query": "sum by ($sumby) (kubelet_working_pods)"},
+        "auxilary_wattage": {"source": "scaphandre", "query": 'sum by ($sumby) (scaph_process_power_consumption_microwatts{container_id=""} > 0)/1e6'},
+        "temp": {"source": "temperature", "query": "max by ($sumby) (node_thermal_zone_temp)"},
+    },
+    "pods": {
+        "kepler": {"source": "kepler", "namespace_label": "container_namespace", "query": "sum by (${ns_by}pod_name, node) (irate(kepler_container_package_joules_total{$ns_match}[$window])) + sum by (${ns_by}pod_name, node)  (irate(kepler_container_core_joules_total{$ns_match}[$window])) + sum by (${ns_by}pod_name, node)  (irate(kepler_container_dram_joules_total{$ns_match}[$window]))"},
+        "scaphandre": {"source": "scaphandre", "query": "sum by (container_id, node) (scaph_process_power_consumption_microwatts$selector/1e6)"},
+        "cpu": {"source": "cadvisor", "query": "sum by (${ns_by}pod, instance) (irate(container_cpu_usage_seconds_total{$ns_match}[$window]))"},
+        "memory": {"source": "cadvisor", "query": "avg by (${ns_by}pod,instance) (container_memory_working_set_bytes{$ns_match}/ 1e6)"},
+        "network": {"source": "cadvisor", "query": 'sum by (${ns_by}pod, instance) (rate(container_network_transmit_bytes_total{pod!="",$ns_match}[$window]) + rate(container_network_receive_bytes_total{pod!="",$ns_match}[$window]))/1e6 '},
+    },
+}
+
+
+class MetricCatalogue:
+    """
+    The PromQL queries of the resource tracker. The templates are compiled once, metrics of disabled sources are never queried.
+
+    The catalogue is configured with a dict (tracker_metrics in clue-config.yaml):
+        window: "1m"             # range of rate and irate
+        sources: {tapo: false}   # enable or disable exporters, all are enabled by default
+        nodes: {cpu: {query: ...}}  # override the query or source of single metrics
+        pods: {...}
+
+    With recording_rules, metrics whose clue:* series (see rule_groups()) exist in Prometheus are read from
+    the recorded series instead of being evaluated on every tick.
+    """
+
+    def __init__(self, catalogue: dict = None, sumby: str = "instance", recording_rules: bool = False):
+        catalogue = catalogue or {}
+        self.window = catalogue.get("window", "1m")
+        self.sumby = sumby
+        self.recording_rules = recording_rules
+        # (scope, name) of the metrics that are read from recorded series, known after validate()
+        self.recorded = set()
+        unknown = set(catalogue.get("sources", {})) - set(SOURCES)
+        if unknown:
+            raise ValueError(f"Unknown metric sources {sorted(unknown)}, known sources are {sorted(SOURCES)}")
+        self.sources = {name: True for name in SOURCES}
+        self.sources.update(catalogue.get("sources", {}))
+
+        self.metrics = {}
+        for scope, defaults in METRICS.items():
+            metrics = {name: dict(metric) for name, metric in defaults.items()}
+            for name, override in (catalogue.get(scope) or {}).items():
+                if name not in metrics:
+                    # the samples have a fixed set of fields, additional metrics could not be stored
+                    logger.warning(f"Ignoring unknown {scope} metric {name}, known metrics are {list(metrics)}")
+                    continue
+                if override.get("source", metrics[name]["source"]) not in SOURCES:
+                    raise ValueError(f"Unknown source {override['source']} of {scope} metric {name}")
+                metrics[name].update(override)
+            self.metrics[scope] = metrics
+        self._compile()
+
+    def _compile(self):
+        # the static placeholders are substituted once, the namespace placeholders when the namespaces are known
+        self._templates = {
+            scope: {
+                name: Template(self._lookup(scope, name) if (scope, name) in self.recorded else self._static(metric))
+                for name, metric in metrics.items() if self.sources[metric["source"]]
+            }
+            for scope, metrics in self.metrics.items()
+        }
+        self._node_queries = {name: template.substitute() for name, template in self._templates["nodes"].items()}
+        self._pod_queries = {}
+
+    def _static(self, metric: dict):
+        return Template(metric["query"]).safe_substitute(sumby=self.sumby, window=self.window)
+
+    def record_name(self, scope: str, name: str):
+        """The name of the recorded series of a metric, e.g. clue:nodes_cpu:1m. Rules of another window are not used."""
+        return f"clue:{scope}_{name}:{self.window}"
+
+    def _lookup(self, scope: str, name: str):
+        # the query template of a recorded metric, the recorded pod series keep the namespace and container labels
+        record = self.record_name(scope, name)
+        if scope == "nodes":
+            return record
+        if name == "scaphandre":
+            return record + "$selector"
+        return record + "{$ns_match}"
+
+    def expression(self, scope: str, name: str):
+        """The expression of the recording rule of a metric. Pod metrics are recorded for all namespaces, grouped by namespace."""
+        metric = self.metrics[scope][name]
+        expr = self._static(metric)
+        if scope == "pods":
+            label = metric.get("namespace_label", "namespace")
+            expr = Template(expr).safe_substitute(ns_match="", ns_by=f"{label}, ", selector="")
+            # drop the emptied namespace matchers, e.g. {} or {pod!="",}
+            expr = re.sub(r"\{\s*\}", "", re.sub(r",\s*\}", "}", expr))
+        return expr.strip()
+
+    def rule_groups(self, interval: str = None):
+        """The Prometheus rule groups that precompute the metrics of all enabled sources."""
+        rules = [
+            {"record": self.record_name(scope, name), "expr": self.expression(scope, name)}
+            for scope, metrics in self.metrics.items()
+            for name, metric in metrics.items() if self.sources[metric["source"]]
+        ]
+        group = {"name": "clue"}
+        if interval:
+            group["interval"] = interval
+        group["rules"] = rules
+        return {"groups": [group]}
+
+    def validate(self, available_metrics: set):
+        """
+        Check the probe metrics of all enabled sources, raise for missing required sources and disable missing optional ones.
+        In recording rules mode, metrics with a recorded series are read from that series.
+        """
+        for name, source in SOURCES.items():
+            if not self.sources[name]:
+                continue
+            missing = set(source["probe"]) - available_metrics
+            if not missing:
+                continue
+            if source["required"]:
+                raise ValueError(f"Prometheus does not provide the required metrics {sorted(missing)} of {name}.")
+            logger.warning(f"Prometheus does not provide the {name} metrics {sorted(missing)}, the source is disabled.")
+            self.sources[name] = False
+        if self.recording_rules:
+            self.recorded = {
+                (scope, name) for scope, metrics in self.metrics.items() for name in metrics
+                if self.record_name(scope, name) in available_metrics
+            }
+            total = sum(1 for metrics in self.metrics.values() for metric in metrics.values() if self.sources[metric["source"]])
+            recorded = sum(1 for scope, name in self.recorded if self.sources[self.metrics[scope][name]["source"]])
+            logger.info(f"{recorded} of {total} metrics are read from recording rules")
+        self._compile()
+        logger.info(f"Metric sources: {', '.join(name for name, enabled in self.sources.items() if enabled)}")
+
+    def enabled(self, source: str):
+        return self.sources[source]
+
+    def node_queries(self):
+        """The queries of the node metrics of enabled sources."""
+        return self._node_queries
+
+    def pod_queries(self, namespaces: list, batched: bool = False):
+        """
+        The queries of the pod metrics of enabled sources for the given namespaces, compiled once per namespace set.
+        Batched queries match all namespaces with a regex and keep the namespace label in the results.
+        """
+        key = (tuple(namespaces), batched)
+        if key not in self._pod_queries:
+            queries = {}
+            for name, template in self._templates["pods"].items():
+                label = self.metrics["pods"][name].get("namespace_label", "namespace")
+                if batched:
+                    ns_match, ns_by = f'{label}=~"{"|".join(namespaces)}"', f"{label}, "
+                else:
+                    ns_match, ns_by = f'{label}="{namespaces[0]}"', ""
+                queries[name] = template.safe_substitute(ns_match=ns_match, ns_by=ns_by, selector="")
+            self._pod_queries[key] = queries
+        return self._pod_queries[key]
+
+    def scaphandre_query(self, selector: str):
+        """The scaphandre process query restricted by the given label selector, e.g. {container_id=~"..."}."""
+        return self._templates["pods"]["scaphandre"].safe_substitute(selector=selector)
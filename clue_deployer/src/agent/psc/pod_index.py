@@ -0,0 +1,168 @@
+import threading
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+from clue_deployer.src.logger import logger
+
+
+def pod_entry(pod):
+    """
+    Build the pod index entry of a pod, returns the short uid and the entry with all started containers.
+    """
+    uid = pod.metadata.uid
+    uid = uid[uid.rindex("-")+1:]
+    entry = {
+        "name": pod.metadata.name,
+        "namespace": pod.metadata.namespace,
+        "ip": pod.status.pod_ip,
+        "containers" : [],
+        "terminating": pod.metadata.deletion_timestamp is not None,
+    }
+
+    if pod.status.container_statuses is None:
+        logger.warning("error in pod %s, status %s", pod.metadata.name, pod.status)
+        return uid, entry
+
+    for c in pod.status.container_statuses:
+        if c.container_id is None:
+            logger.debug(f"found container {c.name} without container_id. Skipping.")
+            continue
+        if not c.started:
+            continue
+        cid = c.container_id.split("//")[1]
+        entry["containers"].append({
+            "name": c.name,
+            "id":c.container_id,
+            "cid":cid
+        })
+    return uid, entry
+
+
+class PodIndex:
+    """
+    Pod and container index of a set of namespaces, kept current by a background watch per namespace.
+    The initial state is listed once, afterwards the watch resumes from the last seen resourceVersion
+    and only relists if the version expired (410 Gone).
+    """
+
+    WATCH_TIMEOUT = 300
+
+    def __init__(self, api: client.CoreV1Api, namespaces: list):
+        self.api = api
+        self.namespaces = namespaces
+        self._pods = {}  # uid -> entry
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._names = None
+        self._stopped = threading.Event()
+        self._watches = []
+        self._threads = []
+
+    def start(self):
+        """List all pods once and start watching the namespaces for changes."""
+        for namespace in self.namespaces:
+            resource_version = self._list(namespace)
+            thread = threading.Thread(
+                target=self._watch,
+                args=(namespace, resource_version),
+                daemon=True,
+                name=f"pod-index-{namespace}",
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Pod index initialized with {len(self._pods)} pods, watching namespaces {self.namespaces}")
+
+    def stop(self):
+        self._stopped.set()
+        for w in self._watches:
+            w.stop()
+
+    def _list(self, namespace: str):
+        pods_request = self.api.list_namespaced_pod(namespace)
+        with self._lock:
+            for uid in [uid for uid, entry in self._pods.items() if entry["namespace"] == namespace]:
+                del self._pods[uid]
+            for pod in pods_request.items:
+                uid, entry = pod_entry(pod)
+                self._pods[uid] = entry
+            self._snapshot = None
+        return pods_request.metadata.resource_version
+
+    def _watch(self, namespace: str, resource_version: str):
+        while not self._stopped.is_set():
+            w = watch.Watch()
+            self._watches.append(w)
+            try:
+                for event in w.stream(
+                        self.api.list_namespaced_pod,
+                        namespace,
+                        resource_version=resource_version,
+                        timeout_seconds=self.WATCH_TIMEOUT,
+                        allow_watch_bookmarks=True,
+                    ):
+                    if event["type"] == "ERROR":
+                        raise ApiException(status=event["raw_object"].get("code"), reason=event["raw_object"].get("reason"))
+                    self._apply(event["type"], event["object"])
+                # resume where the watch stopped
+                resource_version = w.resource_version or resource_version
+            except ApiException as e:
+                if self._stopped.is_set():
+                    break
+                if e.status == 410:
+                    logger.debug(f"Pod watch for namespace {namespace} expired, relisting")
+                else:
+                    logger.warning(f"Pod watch for namespace {namespace} failed, relisting: {e}")
+                    self._stopped.wait(1)
+                try:
+                    resource_version = self._list(namespace)
+                except Exception as e:
+                    logger.warning(f"Failed to list pods of namespace {namespace}: {e}")
+                    self._stopped.wait(1)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                logger.warning(f"Pod watch for namespace {namespace} interrupted: {e}")
+                resource_version = w.resource_version or resource_version
+                self._stopped.wait(1)
+            finally:
+                self._watches.remove(w)
+
+    def _apply(self, event_type: str, pod):
+        if event_type == "BOOKMARK":
+            return
+        uid, entry = pod_entry(pod)
+        with self._lock:
+            if event_type == "DELETED":
+                self._pods.pop(uid, None)
+            else:
+                self._pods[uid] = entry
+            self._snapshot = None
+
+    def _build(self):
+        snapshot = {}
+        names = {namespace: set() for namespace in self.namespaces}
+        for uid, entry in self._pods.items():
+            snapshot[uid] = entry
+            # prepare fast lookup
+            for container in entry["containers"]:
+                snapshot[container["cid"]] = entry
+            if not entry["terminating"]:
+                names.setdefault(entry["namespace"], set()).add(entry["name"])
+        self._snapshot = snapshot
+        self._names = names
+
+    def snapshot(self):
+        """
+        The pod index keyed by short pod uid and container id, in the format of ResourceTracker.fetch_pods.
+        The returned dict is not modified by the watch and can be used for the whole tracking cycle.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                self._build()
+            return self._snapshot
+
+    def pod_names(self, namespace: str):
+        """The names of all pods of the namespace that are not terminating."""
+        with self._lock:
+            if self._snapshot is None:
+                self._build()
+            return self._names.get(namespace, set())
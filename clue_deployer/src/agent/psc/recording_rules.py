@@ -0,0 +1,57 @@
+"""
+Generate the Prometheus recording rules of the resource tracker's metrics.
+
+The rules precompute the node and pod queries once per evaluation interval in Prometheus. A tracker with
+tracker_recording_rules (RECORDING_RULES=true for the agent) reads the recorded clue:* series instead of
+evaluating the queries on every tick. The metrics follow tracker_metrics of the given clue-config.yaml.
+
+    python -m clue_deployer.src.agent.psc.recording_rules [--config clue-config.yaml] [--output clue-rules.yaml]
+        [--interval 15s] [--prometheus-rule clue-recording-rules --namespace monitoring]
+
+Load the output as a rule file of Prometheus, or with --prometheus-rule apply it as a PrometheusRule of the
+Prometheus operator (kubectl apply -f clue-rules.yaml).
+"""
+import argparse
+import sys
+import yaml
+from .metric_catalogue import MetricCatalogue
+
+
+def prometheus_rule(rules: dict, name: str, namespace: str = None, labels: dict = None):
+    """Wrap the rule groups into a PrometheusRule resource of the Prometheus operator."""
+    metadata = {"name": name}
+    if namespace:
+        metadata["namespace"] = namespace
+    if labels:
+        metadata["labels"] = labels
+    return {"apiVersion": "monitoring.coreos.com/v1", "kind": "PrometheusRule", "metadata": metadata, "spec": rules}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="clue-config.yaml", help="the clue config with the tracker_metrics")
+    parser.add_argument("--output", help="the rule file to write, stdout if not given")
+    parser.add_argument("--interval", help="evaluation interval of the rule group, the global interval of Prometheus if not given")
+    parser.add_argument("--prometheus-rule", metavar="NAME", help="emit a PrometheusRule resource with this name")
+    parser.add_argument("--namespace", help="namespace of the PrometheusRule")
+    parser.add_argument("--label", action="append", default=[], metavar="KEY=VALUE",
+                        help="label of the PrometheusRule, e.g. release=kps1 to match the rule selector of the operator")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f).get("config", {})
+    catalogue = MetricCatalogue(config.get("tracker_metrics"))
+    rules = catalogue.rule_groups(args.interval)
+    if args.prometheus_rule:
+        rules = prometheus_rule(rules, args.prometheus_rule, args.namespace, dict(label.split("=", 1) for label in args.label))
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        yaml.safe_dump(rules, out, sort_keys=False, width=1000)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import threading
+
+
+class FixedQueue:
+    """
+    A fixed size ring buffer of the latest samples, the oldest sample is overwritten when a new one is added if the buffer is full.
+
+    Every sample gets a sequence number (1, 2, ...) when it is added. Reading never removes samples, every reader
+    keeps its own cursor (the sequence number of the last sample it read), so any number of streams and downloads
+    see the same samples. Puts are serialized, reads take no lock: a read copies the slots and drops the ones a
+    concurrent put overwrote in the meantime.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError(f"Invalid ring buffer size {size}")
+        self.maxsize = size
+        self._slots = [None] * size
+        # sequence number of the last added sample
+        self.last_seq = 0
+        # sequence number of the sample that is being added, equal to last_seq between puts
+        self._writing = 0
+        self._added = threading.Condition()
+
+    def put(self, item):
+        with self._added:
+            seq = self.last_seq + 1
+            self._writing = seq
+            self._slots[(seq - 1) % self.maxsize] = item
+            self.last_seq = seq
+            self._added.notify_all()
+
+    def wait(self, cursor, timeout=None):
+        """Wait up to timeout seconds for a sample newer than cursor, returns whether one exists."""
+        if self.last_seq > cursor:
+            return True
+        with self._added:
+            return self._added.wait_for(lambda: self.last_seq > cursor, timeout)
+
+    def since(self, cursor, limit, timeout=None):
+        """
+        Return (last sequence number, samples) of up to limit samples added after cursor.
+        Waits up to timeout seconds if no sample is newer than cursor, the cursor is returned unchanged if none arrived.
+        Overwritten samples are skipped, the sequence number of the first sample is last - len(samples) + 1.
+        A cursor ahead of the buffer (e.g. after an agent restart) starts from the oldest retained sample.
+        """
+        if cursor > self.last_seq:
+            cursor = 0
+        if timeout is not None:
+            self.wait(cursor, timeout)
+        last = self.last_seq
+        first = max(cursor + 1, last - self.maxsize + 1)
+        end = min(last, first + limit - 1)
+        items = [self._slots[(seq - 1) % self.maxsize] for seq in range(first, end + 1)]
+        # slots up to _writing - maxsize were overwritten by puts during the copy
+        oldest = self._writing - self.maxsize + 1
+        if first < oldest:
+            items = items[oldest - first:]
+        return (end if items else cursor, items)
+
+    def latest(self, n):
+        """The up to n newest samples, oldest first."""
+        return self.since(max(self.last_seq - n, 0), n)[1]
+
+    def elements(self):
+        return self.latest(self.maxsize)
+
+    def reader(self, cursor=0):
+        """A reader that starts after cursor, 0 starts from the oldest retained sample."""
+        return Reader(self, cursor)
+
+    def __len__(self):
+        return min(self.last_seq, self.maxsize)
+
+
+class Reader:
+    """
+    A cursor on a FixedQueue. Readers do not affect each other, a reader that falls more than the buffer size
+    behind skips the overwritten samples and counts them in dropped.
+    """
+
+    def __init__(self, channel: FixedQueue, cursor=0):
+        self.channel = channel
+        self.cursor = cursor
+        self.dropped = 0
+
+    def wait(self, timeout=None):
+        return self.channel.wait(self.cursor, timeout)
+
+    def read(self, limit, timeout=None):
+        """Up to limit samples after the cursor, waits up to timeout seconds if there are none."""
+        cursor = self.cursor if self.cursor <= self.channel.last_seq else 0
+        last, items = self.channel.since(cursor, limit, timeout)
+        if items:
+            if cursor > 0:
+                self.dropped += last - len(items) - cursor
+            self.cursor = last
+        return items
+
+    def get(self, timeout=None):
+        """The next sample, None if none arrived within timeout."""
+        items = self.read(1, timeout)
+        return items[0] if items else None
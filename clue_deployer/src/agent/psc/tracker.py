@@ -1,16 +1,35 @@
 import datetime
 from prometheus_api_client import PrometheusConnect
 from clue_deployer.src.logger import logger
-from threading import Timer
+from threading import Event, Lock, Thread
 from kubernetes import client, config
 import copy 
 import os
+import time
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
+from .pod_index import PodIndex, pod_entry
+from .metric_catalogue import MetricCatalogue
+from .adaptive_interval import AdaptiveInterval
 
 
-#TODO: make a cluster cunfig class that can be used to configure the tracker, it should allow to specifiy the prometheus url, the k8s api url, the namespaces to track, the update interval, and the queries to use for each metric. 
+def _format_time(epoch):
+    """Render an epoch timestamp (seconds) the way the CSV files always stored it."""
+    if epoch is None:
+        return None
+    return datetime.datetime.fromtimestamp(epoch)
+
 class NodeUsage:
-        _fields = ["instance", "observation_time", "collection_time", "cpu_usage", "memory_usage", "network_usage", "wattage", "num_processes", "wattage_kepler", "wattage_scaph","wattage_auxilary","temperture"]
+        """
+        A node sample. Numeric values are parsed to float once and times are stored as epoch seconds.
+        """
+        _fields = ["instance", "observation_time", "collection_time", "cpu_usage", "memory_usage", "network_usage", "wattage", "num_processes", "wattage_kepler", "wattage_scaph","wattage_auxilary","temperture", "interval"]
+        # column types of the columnar output, all other fields are numbers
+        _types = {"instance": "string", "observation_time": "timestamp", "collection_time": "timestamp"}
+        __slots__ = ("instance", "observation_time", "collection_time", "cpu_usage", "memory_usage", "network_usage", "wattage", "num_processes", "wattage_kepler", "wattage_scaph", "wattage_auxilary", "temp", "interval")
 
         def __init__(self, instance):
             self.instance = instance
@@ -25,29 +44,41 @@ class NodeUsage:
             self.wattage_scaph = None
             self.wattage_auxilary = None
             self.temp = None
-            
+            # seconds since the previous sample, varies with the adaptive interval
+            self.interval = None
+
+        def to_row(self):
+            """The sample values in the order of _fields."""
+            return [
+                self.instance,
+                _format_time(self.observation_time),
+                _format_time(self.collection_time),
+                self.cpu_usage,
+                self.memory_usage,
+                self.network_usage,
+                self.wattage,
+                self.num_processes,
+                self.wattage_kepler,
+                self.wattage_scaph,
+                self.wattage_auxilary,
+                self.temp,
+                self.interval,
+            ]
     
         def to_dict(self):
-            return {
-                "instance": self.instance,
-                "observation_time": self.observation_time,
-                "collection_time": self.collection_time,
-                "cpu_usage": self.cpu_usage,
-                "memory_usage": self.memory_usage,
-                "network_usage": self.network_usage,
-                "wattage": self.wattage,
-                "num_processes": self.num_processes,
-                "wattage_kepler": self.wattage_kepler,
-                "wattage_scaph": self.wattage_scaph,
-                "wattage_auxilary": self.wattage_auxilary,
-                "temperture": self.temp
-            }
+            return dict(zip(self._fields, self.to_row()))
 
         def __str__(self) -> str:
             return self.to_dict().__str__()
 
 class PodUsage:
-    _fields = ["collection_time","observation_time", "name","namespace","cpu_usage", "memory_usage", "network_usage", "instance", "wattage_kepler", "wattage_scaph"]
+    """
+    A pod sample. Numeric values are parsed to float once and times are stored as epoch seconds.
+    """
+    _fields = ["collection_time","observation_time", "name","namespace","cpu_usage", "memory_usage", "network_usage", "instance", "wattage_kepler", "wattage_scaph", "interval"]
+    # column types of the columnar output, all other fields are numbers
+    _types = {"collection_time": "timestamp", "observation_time": "timestamp", "name": "string", "namespace": "string", "instance": "string"}
+    __slots__ = ("collection_time", "observation_time", "name", "namespace", "cpu_usage", "memory_usage", "network_usage", "instance", "kepler_consumtion", "scaphandre_consumtion", "interval")
 
     def __init__(self):
         self.collection_time = None
@@ -60,39 +91,119 @@ class PodUsage:
         self.instance = None
         self.kepler_consumtion = None
         self.scaphandre_consumtion = None
+        self.interval = None
+
+    def to_row(self):
+        """The sample values in the order of _fields."""
+        return [
+            _format_time(self.collection_time),
+            _format_time(self.observation_time),
+            self.name,
+            self.namespace,
+            self.cpu_usage,
+            self.memory_usage,
+            self.network_usage,
+            self.instance,
+            self.kepler_consumtion,
+            self.scaphandre_consumtion,
+            self.interval,
+        ]
 
     def to_dict(self):
-        return {
-            "collection_time": self.collection_time,
-            "observation_time": self.observation_time,
-            "name": self.name,
-            "namespace": self.namespace,
-            "cpu_usage": self.cpu_usage,
-            "memory_usage": self.memory_usage,
-            "network_usage": self.network_usage,
-            "instance": self.instance,
-            "wattage_kepler": self.kepler_consumtion,
-            "wattage_scaph": self.scaphandre_consumtion
-        }
-
-class RepeatTimer(Timer):
+        return dict(zip(self._fields, self.to_row()))
+
+class MonotonicScheduler(Thread):
+    """
+    Calls function on a grid of the monotonic clock, starting one interval after start().
+    Ticks are scheduled relative to the previous scheduled tick, not to the end of the previous call,
+    so slow calls do not shift the grid. Ticks that are already over when a call returns are skipped and counted.
+    The interval can be changed while running, the grid continues from the last tick with the new interval.
+    """
+
+    def __init__(self, interval, function, args=None, kwargs=None):
+        super().__init__(daemon=True, name="tracker-scheduler")
+        self.interval = interval
+        self.function = function
+        self.args = args if args is not None else []
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.finished = Event()
+        self._lock = Lock()
+        self.ticks = 0
+        self.skipped = 0
+        self.overruns = 0
+        self._jitter_sum = 0.0
+        self.max_jitter = 0.0
+        self.max_overrun = 0.0
+
+    def cancel(self):
+        self.finished.set()
 
     def run(self):
-        while not self.finished.wait(self.interval):
+        next_tick = time.monotonic() + self.interval
+        while not self.finished.wait(max(0.0, next_tick - time.monotonic())):
+            scheduled = next_tick
+            fired = time.monotonic()
             self.function(*self.args, **self.kwargs)
+            now = time.monotonic()
+            next_tick = scheduled + self.interval
+            missed = 0
+            if now >= next_tick:
+                # the call took longer than the interval, continue on the grid instead of catching up
+                missed = int((now - next_tick) // self.interval) + 1
+                next_tick += missed * self.interval
+            self._record(fired - scheduled, now - scheduled - self.interval, missed)
+
+    def _record(self, jitter: float, overrun: float, missed: int):
+        with self._lock:
+            self.ticks += 1
+            self._jitter_sum += jitter
+            self.max_jitter = max(self.max_jitter, jitter)
+            if missed:
+                self.skipped += missed
+                self.overruns += 1
+                self.max_overrun = max(self.max_overrun, overrun)
+                logger.warning(f"Tracking cycle overran the interval of {self.interval}s by {overrun:.2f}s, skipped {missed} tick(s)")
+
+    def stats(self):
+        """Tick statistics: fired and skipped ticks, start jitter and overruns (seconds)."""
+        with self._lock:
+            return {
+                "ticks": self.ticks,
+                "skipped": self.skipped,
+                "mean_jitter": self._jitter_sum / self.ticks if self.ticks else 0.0,
+                "max_jitter": self.max_jitter,
+                "overruns": self.overruns,
+                "max_overrun": self.max_overrun,
+            }
 
 class ResourceTracker:
 
+    POD_METRICS = ["cpu", "memory", "kepler", "scaphandre"]
+    # container ids per scaphandre query, keeps the query url of a chunk around 7kB
+    SCAPHANDRE_CHUNK_SIZE = 100
+
     def __init__(self, 
                  prometheus_url :str , 
                  node_channel:Queue, 
                  pod_channel:Queue,
                  namespaces=["default"], 
                  interval=30,
+                 concurrent_queries=False,
+                 max_workers=8,
+                 batch_namespaces=False,
+                 watch_pods=False,
+                 node_map_ttl=300,
+                 vectorized=False,
+                 filter_scaphandre=False,
+                 metrics=None,
+                 recording_rules=False,
+                 adaptive_interval: AdaptiveInterval = None,
                  ):
         
 
         self.sumby = "instance" # or node
+        # (nodes, pods) of the last tracking cycle
+        self.last_samples = None
 
         self.prometheus_url = prometheus_url
         if self.prometheus_url:
@@ -103,8 +214,30 @@ class ResourceTracker:
             self.node_channel = node_channel
             self.pod_channel = pod_channel
             self.UPDATE_INTERVAL = interval
-            self.timer = RepeatTimer(interval, self.update)
+            self.timer = MonotonicScheduler(interval, self.update)
             self.namespaces = namespaces
+            # issue all queries of a tracking cycle in parallel, the default session pool of PrometheusConnect holds 10 connections
+            self.concurrent_queries = concurrent_queries
+            self.max_workers = max_workers
+            # query all namespaces with a single regex matcher per metric and split the results client-side
+            self.batch_namespaces = batch_namespaces
+            # the IP to node name mapping rarely changes, refresh it only after the ttl or for unknown instances
+            self.node_map_ttl = node_map_ttl
+            self._node_map_refreshed = None
+            # parse the pod results into frames and merge them with a single join
+            self.vectorized = vectorized
+            # only query the scaphandre processes of the tracked containers
+            self.filter_scaphandre = filter_scaphandre
+            # the queries of all metrics, compiled once. Sources that are disabled or not deployed are never queried
+            # with recording_rules, metrics with a recorded clue:* series are instant lookups of that series
+            self.catalogue = MetricCatalogue(metrics, sumby=self.sumby, recording_rules=recording_rules)
+            # shorten the interval while the load changes and lengthen it during steady state, otherwise a fixed interval
+            self.adaptive_interval = adaptive_interval
+            self._last_tick = None
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tracker-query") if concurrent_queries else None
+            # wall-clock duration of the tracking cycles, should stay well below the update interval
+            self.last_cycle_duration = None
+            self.max_cycle_duration = 0.0
             self.initialize_and_validate_metrics()
 
             if os.getenv("KUBERNETES_SERVICE_HOST"):
@@ -112,6 +245,11 @@ class ResourceTracker:
             else:
                 config.load_kube_config()
             self.k8s_api_client = client.CoreV1Api()
+            # keep the pods of the tracked namespaces in a watched index instead of listing them every cycle
+            self.pod_index = None
+            if watch_pods:
+                self.pod_index = PodIndex(self.k8s_api_client, self.namespaces)
+                self.pod_index.start()
             logger.info("Resource Tracker initialized.")
         else:
             self.prm = None
@@ -119,14 +257,12 @@ class ResourceTracker:
 
 
     def initialize_and_validate_metrics(self):
-        available = set(self.prm.all_metrics())
+        # the metric names are only probed once, all_metrics downloads every series name from Prometheus
+        self.available_metrics = set(self.prm.all_metrics())
+        available = self.available_metrics
 
-        #check node_exporter metrics - cpu/memory
-        required = {"node_memory_MemFree_bytes", "node_memory_MemTotal_bytes", "node_cpu_seconds_total","node_memory_Cached_bytes", "kepler_container_joules_total", 
-                    "node_network_receive_bytes_total", "node_network_transmit_bytes_total", "container_cpu_usage_seconds_total", "container_memory_working_set_bytes"}
-        
-        if not required.issubset(available):
-            raise ValueError("Prometheus does not provide the required metrics.")
+        #check the metrics of the enabled sources - node_exporter/cadvisor/kepler are required, absent optional exporters are disabled
+        self.catalogue.validate(available)
 
         #check if prometheus is managing a kubernetes cluster on container or node level
         if "container_network_transmit_bytes_total" in available:
@@ -136,16 +272,16 @@ class ResourceTracker:
         else:
             raise ValueError("Prometheus does not provide a vaild network metric.")
         
-        # Initialize node_map - will be refreshed during each track() call
+        # Initialize node_map - will be refreshed by track() once the ttl expired
         logger.info("prometheus_url is set, initializing node_map. and fetching meticis.")
         self.node_map = {}
         self._refresh_node_map()
 
     def _refresh_node_map(self):
         """Refresh the node mapping from IP to node name"""
+        self._node_map_refreshed = time.monotonic()
         try:
-            available = set(self.prm.all_metrics())
-            if "kube_node_info" in available:
+            if "kube_node_info" in self.available_metrics:
                 info = self.prm.get_current_metric_value("kube_node_info")
                 # Build a mapping from instance to the node name (instance: IP:9100||10250 --> node exporter + prometheus operator port) 
                 new_node_map = {}
@@ -167,6 +303,25 @@ class ResourceTracker:
         except Exception as e:
             logger.warning(f"Failed to refresh node_map: {e}")
 
+    def _node_map_age(self):
+        if self._node_map_refreshed is None:
+            return None
+        return time.monotonic() - self._node_map_refreshed
+
+    def _ensure_node_map(self, instances=()):
+        """
+        Refresh the node map if the ttl expired or if one of the given instances has no known node,
+        unknown instances trigger at most one refresh per update interval.
+        """
+        age = self._node_map_age()
+        if age is None or age > self.node_map_ttl:
+            self._refresh_node_map()
+            return
+        unknown = [i for i in instances if i.split(":")[0] not in self.node_map]
+        if unknown and age > self.UPDATE_INTERVAL:
+            logger.debug(f"Refreshing node_map for unknown instances {unknown}")
+            self._refresh_node_map()
+
     def update(self):
         try:
             self.track()
@@ -178,6 +333,8 @@ class ResourceTracker:
         Get the names of all currently running pods in the specified namespace.
         This is used to validate that metrics correspond to actual existing pods.
         """
+        if self.pod_index is not None:
+            return self.pod_index.pod_names(namespace)
         try:
             pods_request = self.k8s_api_client.list_namespaced_pod(namespace)
             current_pod_names = set()
@@ -192,67 +349,68 @@ class ResourceTracker:
             return set()  # Return empty set on error to avoid blocking metrics collection
 
     def fetch_pods(self):
+        if self.pod_index is not None:
+            return self.pod_index.snapshot()
         pods = {}
         for namespace in self.namespaces:
             pods_request = self.k8s_api_client.list_namespaced_pod(namespace)
             for pod in pods_request.items:
-                uid = pod.metadata.uid
-                uid = uid[uid.rindex("-")+1:]
-                pods[uid] = {
-                    "name": pod.metadata.name,
-                    "namespace": pod.metadata.namespace,
-                    "ip": pod.status.pod_ip,
-                    "containers" : []
-                }
-                
-                if pod.status.container_statuses is None:
-                    logger.warning("error in pod %s, status %s", pod.metadata.name, pod.status)
-                    continue
-
-                for c in pod.status.container_statuses:
-                    if c.container_id is None:
-                        logger.debug(f"found container {c.name} without container_id. Skipping.")
-                        continue
-                    if not c.started:
-                        continue
-                    cid = c.container_id.split("//")[1]
-                    pods[uid]["containers"].append({
-                        "name": c.name,
-                        "id":c.container_id,
-                        "cid":cid
-                    })
+                uid, entry = pod_entry(pod)
+                pods[uid] = entry
+                for c in entry["containers"]:
                     #prepare fast lookup
-                    pods[cid] = pods[uid]
+                    pods[c["cid"]] = entry
 
             logger.debug(f"found {len(pods)} pods")
         return pods
 
-    def _query_nodes(self):
-        memory = f"sum by ({self.sumby}) ((1 - ((avg_over_time(node_memory_MemFree_bytes[1m]) + avg_over_time(node_memory_Cached_bytes[1m]) + avg_over_time(node_memory_Buffers_bytes[1m])) / avg_over_time(node_memory_MemTotal_bytes[1m]))))" # Memory usage ratio (0 - 1) percentaage
-        cpu = f"sum by ({self.sumby}) (rate(node_cpu_seconds_total{{mode!=\"idle\"}}[1m]))" # CPU seconds ratio (1 ~ 1 full core used)
-        network = f"sum by ({self.sumby}) (rate(node_network_receive_bytes_total[1m])+rate(node_network_transmit_bytes_total[1m]))/1e6" # MB/s
-        kepler = f"sum by ({self.sumby}) (irate(kepler_node_core_joules_total[60s])) + sum by ({self.sumby}) (irate(kepler_node_uncore_joules_total[60s])) +sum by ({self.sumby}) (irate(kepler_node_package_joules_total[60s])) + sum by ({self.sumby}) (irate(kepler_node_dram_joules_total[60s]))" # Watt
-        scaphandre = f"sum by ({self.sumby}) (scaph_host_power_microwatts/1e6)" # Watt
-        tapo = f"tapo_total_wattage"
-        pods = f"sum by ({self.sumby}) (kubelet_working_pods)"
-        auxilary_wattage = f"sum by ({self.sumby}) (scaph_process_power_consumption_microwatts{{container_id=\"\"}} > 0)/1e6"
-        temp = f"max by ({self.sumby}) (node_thermal_zone_temp)"
-
-        mem_result = self.get_node_metrics(self.prm.custom_query(memory))
-        cpu_result = self.get_node_metrics(self.prm.custom_query(cpu))
-        network_result = self.get_node_metrics(self.prm.custom_query(network))
-        kepler_result = self.get_node_metrics(self.prm.custom_query(kepler))
-        scaphandre_result = self.get_node_metrics(self.prm.custom_query(scaphandre))
-        tapo_result = self.get_node_metrics(self.prm.custom_query(tapo))
-        pods_result = self.get_node_metrics(self.prm.custom_query(pods))
-        auxilary_wattage_result = self.get_node_metrics(self.prm.custom_query(auxilary_wattage))
-        temp_result = self.get_node_metrics(self.prm.custom_query(temp))
+    def _node_queries(self):
+        """
+        The PromQL queries for the node metrics of a single tracking cycle.
+        """
+        return self.catalogue.node_queries()
+
+    def _execute_queries(self, queries: dict, start=None, end=None, step=None):
+        """
+        Run the given PromQL queries and return the raw results under the same keys.
+        A key can also hold a list of queries (chunks), their results are concatenated.
+        If start and end are given, the queries are run as range queries with the given step (seconds).
+        In concurrent mode all queries are fanned out to the query pool and joined afterwards.
+        """
+        if start is not None:
+            def run(query):
+                return self.prm.custom_query_range(query, start_time=start, end_time=end, step=f"{step}s")
+        else:
+            run = self.prm.custom_query
+        chunks = {key: query if isinstance(query, list) else [query] for key, query in queries.items()}
+        if self._executor is None:
+            return {key: [series for query in chunk for series in run(query)] for key, chunk in chunks.items()}
+        futures = {key: [self._executor.submit(run, query) for query in chunk] for key, chunk in chunks.items()}
+        return {key: [series for future in chunk for series in future.result()] for key, chunk in futures.items()}
+
+    def _query_nodes(self, results=None, collection_time=None):
+        if results is None:
+            results = self._execute_queries(self._node_queries())
+        if collection_time is None:
+            collection_time = int(time.time())
+
+        mem_result = self.get_node_metrics(results.get("memory", []))
+        cpu_result = self.get_node_metrics(results.get("cpu", []))
+        network_result = self.get_node_metrics(results.get("network", []))
+        kepler_result = self.get_node_metrics(results.get("kepler", []))
+        scaphandre_result = self.get_node_metrics(results.get("scaphandre", []))
+        tapo_result = self.get_node_metrics(results.get("tapo", []))
+        pods_result = self.get_node_metrics(results.get("pods", []))
+        auxilary_wattage_result = self.get_node_metrics(results.get("auxilary_wattage", []))
+        temp_result = self.get_node_metrics(results.get("temp", []))
 
         nodes = []
         keys = set().union(mem_result.keys(), cpu_result.keys(), network_result.keys(), kepler_result.keys(), scaphandre_result.keys(), tapo_result.keys(), temp_result.keys())
+        # only the instance-keyed results are looked up in the node map, kepler and scaphandre are keyed by node name
+        self._ensure_node_map(set().union(mem_result.keys(), cpu_result.keys(), network_result.keys(), temp_result.keys()))
         for node in keys:
             n = NodeUsage(node)
-            n.collection_time = datetime.datetime.now().replace(microsecond=0)
+            n.collection_time = collection_time
             n.cpu_usage = cpu_result.get(node, {"value":0})["value"]
             n.memory_usage = mem_result.get(node, {"value":0})["value"]
             n.network_usage = network_result.get(node, {"value":0})["value"]
@@ -275,7 +433,6 @@ class ResourceTracker:
             n.observation_time = cpu_result.get(node, {"timestamp":None})["timestamp"]
             if n.observation_time is None:
                 continue
-            n.observation_time = n.observation_time.replace(microsecond=0)
             n.num_processes = pods_result.get(node, {"value":0})["value"]
             n.temp = temp_result.get(node, {"value":0})["value"]
 
@@ -283,42 +440,95 @@ class ResourceTracker:
 
         return nodes
 
-    def _query_pods(self, namespace:str, pod_index = {}):
+    def _scaphandre_queries(self, namespaces: list, pod_index=None):
+        """
+        The scaphandre process power query. Without container filter it returns every process of the cluster,
+        with filter_scaphandre the container ids of the pod index are pushed into the query in chunks.
+        """
+        if not self.filter_scaphandre or pod_index is None:
+            return self.catalogue.scaphandre_query("")
+        container_ids = sorted({
+            container["cid"]
+            for entry in pod_index.values() if entry["namespace"] in namespaces
+            for container in entry["containers"]
+        })
+        queries = []
+        for i in range(0, len(container_ids), self.SCAPHANDRE_CHUNK_SIZE):
+            matcher = "|".join(container_ids[i:i + self.SCAPHANDRE_CHUNK_SIZE])
+            queries.append(self.catalogue.scaphandre_query(f'{{container_id=~"(cri-containerd-)?({matcher})"}}'))
+        return queries
+
+    def _pod_queries(self, namespace:str, pod_index=None):
+        """
+        The PromQL queries for the pod metrics of a single namespace.
+        """
+        queries = dict(self.catalogue.pod_queries([namespace]))
+        if "scaphandre" in queries:
+            queries["scaphandre"] = self._scaphandre_queries([namespace], pod_index)
+        return queries
+
+    def _batched_pod_queries(self, namespaces: list, pod_index=None):
+        """
+        The PromQL queries for the pod metrics of all given namespaces, one query per metric.
+        The results are grouped by namespace so they can be split with _split_by_namespace.
+        """
+        queries = dict(self.catalogue.pod_queries(namespaces, batched=True))
+        if "scaphandre" in queries:
+            queries["scaphandre"] = self._scaphandre_queries(namespaces, pod_index)
+        return queries
+
+    def _split_by_namespace(self, results: dict, namespace: str):
+        """
+        Select the series of a single namespace from the results of the batched pod queries.
+        Series without namespace label (scaphandre) are kept, they are resolved to the pods of the namespace through the pod index.
+        """
+        split = {}
+        for key, result in results.items():
+            split[key] = []
+            for series in result:
+                metric = series.get("metric", {})
+                series_namespace = metric.get("namespace", metric.get("container_namespace"))
+                if series_namespace is None or series_namespace == namespace:
+                    split[key].append(series)
+        return split
+
+    def _query_pods(self, namespace:str, pod_index = {}, results=None, collection_time=None, validate_pods=True):
         """
         Query Prometheus for the current resource usage of pods. Assuming kepler and scaphandre are availible as well as kube metrics.
         """
-        kepler_consumtion = f'sum by (pod_name, node) (irate(kepler_container_package_joules_total{{container_namespace="{namespace}"}}[1m])) + sum by (pod_name, node)  (irate(kepler_container_core_joules_total{{container_namespace="{namespace}"}}[1m])) + sum by (pod_name, node)  (irate(kepler_container_dram_joules_total{{container_namespace="{namespace}"}}[1m]))'#f'sum by (pod_name, node) (irate(kepler_container_joules_total{{container_namespace="{namespace}"}}[1m]))'
-        scraphandre_consumtion = f'sum by (container_id, node) (scaph_process_power_consumption_microwatts/1e6)'
-        
-        cpu_pod = f'sum by (pod, instance) (irate(container_cpu_usage_seconds_total{{namespace="{namespace}"}}[1m]))'
-        memory_pod = f'avg by (pod,instance) (container_memory_working_set_bytes{{namespace="{namespace}"}}/ 1e6)'
-        network_pod = f'sum by (pod, instance) (rate(container_network_transmit_bytes_total{{pod!="",namespace="{namespace}"}}[1m]) + rate(container_network_receive_bytes_total{{pod!="",namespace="{namespace}"}}[1m]))/1e6 '
-        
-        cpu_pod_result = self.get_pod_metrics(self.prm.custom_query(cpu_pod))
-        memory_pod_result = self.get_pod_metrics(self.prm.custom_query(memory_pod))
-        network_pod_result = self.get_pod_metrics(self.prm.custom_query(network_pod))
-        kepler_consumption_result = self.get_pod_metrics(self.prm.custom_query(kepler_consumtion),node_or_instance_label="node", pod_label="pod_name")
-        scaphandre_consumption_result = self.get_scaphandre_metrics(self.prm.custom_query(scraphandre_consumtion), pod_index)
+        if results is None:
+            results = self._execute_queries(self._pod_queries(namespace, pod_index))
+        if collection_time is None:
+            collection_time = int(time.time())
+        if self.vectorized:
+            return self._merge_pod_frames(namespace, pod_index, results, collection_time, validate_pods)
+
+        cpu_pod_result = self.get_pod_metrics(results.get("cpu", []))
+        memory_pod_result = self.get_pod_metrics(results.get("memory", []))
+        network_pod_result = self.get_pod_metrics(results.get("network", []))
+        kepler_consumption_result = self.get_pod_metrics(results.get("kepler", []),node_or_instance_label="node", pod_label="pod_name")
+        scaphandre_consumption_result = self.get_scaphandre_metrics(results.get("scaphandre", []), pod_index, namespace)
 
         # Get current pods from Kubernetes API to validate against stale metrics
-        current_pods = self._get_current_pod_names(namespace)
+        current_pods = self._get_current_pod_names(namespace) if validate_pods else None
         
         pods = []
         keys = set().union(scaphandre_consumption_result.keys(), kepler_consumption_result.keys(), cpu_pod_result.keys(), memory_pod_result.keys())
         
         # helper function to get the value from the result
+        now = int(time.time())
         def get_value(key, result):
-            val = result.get(key, {"value":0.0, "timestamp":datetime.datetime.now(), "instance":"unknown"})
+            val = result.get(key, {"value":0.0, "timestamp":now, "instance":"unknown"})
             return val
         
         for process in keys:
             # Validate that this pod actually exists in the current cluster
-            if process not in current_pods:
+            if current_pods is not None and process not in current_pods:
                 logger.debug(f"Skipping metrics for pod {process} - not found in current cluster (likely stale metrics)")
                 continue
                 
             pod = PodUsage()
-            pod.collection_time = datetime.datetime.now().replace(microsecond=0)
+            pod.collection_time = collection_time
             pod.name = process
             pod.namespace = namespace
             
@@ -327,10 +537,10 @@ class ResourceTracker:
             kepler = get_value(process, kepler_consumption_result)
             scaphandre = get_value(process, scaphandre_consumption_result)
             
-            pod.cpu_usage = float(cpu["value"])
-            pod.memory_usage =  float(memory["value"])
-            pod.kepler_consumtion =  float(kepler["value"])
-            pod.scaphandre_consumtion =  float(scaphandre["value"])
+            pod.cpu_usage = cpu["value"]
+            pod.memory_usage = memory["value"]
+            pod.kepler_consumtion = kepler["value"]
+            pod.scaphandre_consumtion = scaphandre["value"]
             pod.network_usage = get_value(process, network_pod_result)["value"]
             # XXX warning assumption instance is the same for all metrics
             instance = set([cpu["instance"], memory["instance"], kepler["instance"], scaphandre["instance"]])
@@ -346,7 +556,97 @@ class ResourceTracker:
             else:
                 pod.instance = instance.pop()
             observation_time = min(cpu["timestamp"], memory["timestamp"], kepler["timestamp"], scaphandre["timestamp"])
-            pod.observation_time = observation_time.replace(microsecond=0)
+            pod.observation_time = observation_time
+            pods.append(pod)
+        return pods
+
+    def _result_frame(self, result, name, key_label, node_or_instance_label="instance"):
+        """
+        Convert a query result into a frame with the key label, instance, timestamp and value of every series.
+        """
+        labels = [series.get("metric", {}) for series in result]
+        values = np.array([series["value"] for series in result], dtype=float).reshape(-1, 2)
+        # label columns are kept as plain python objects, they are only used for hashing and lookups
+        return pd.DataFrame({
+            "key": pd.Series([m.get(key_label) for m in labels], dtype=object),
+            f"{name}_instance": pd.Series([m.get("node", m.get(node_or_instance_label, "unknown")) for m in labels], dtype=object),
+            f"{name}_timestamp": values[:, 0],
+            name: values[:, 1],
+        })
+
+    def _pod_frame(self, result, name, pod_label="pod", node_or_instance_label="instance"):
+        """The query result as frame indexed by pod name, like get_pod_metrics the last series of a pod wins."""
+        frame = self._result_frame(result, name, pod_label, node_or_instance_label)
+        frame = frame.dropna(subset=["key"])
+        return frame.drop_duplicates("key", keep="last").set_index("key")
+
+    def _scaphandre_frame(self, result, pod_index, namespace=None):
+        """
+        The scaphandre result as frame indexed by pod name, resolving the container ids with the pod index.
+        Only the containers of the pods in namespace are resolved, the series have no namespace label.
+        """
+        frame = self._result_frame(result, "scaphandre", "container_id")
+        names = {key: entry["name"] for key, entry in pod_index.items() if namespace is None or entry["namespace"] == namespace}
+        container_ids = frame["key"]
+        stripped = pd.Series([c[15:] if c and c.startswith("cri-containerd-") else c for c in container_ids.tolist()], index=frame.index, dtype=object)
+        frame["key"] = container_ids.map(names).fillna(stripped.map(names))
+        frame = frame.dropna(subset=["key"])
+        return frame.drop_duplicates("key", keep="last").set_index("key")
+
+    def _merge_pod_frames(self, namespace: str, pod_index, results, collection_time, validate_pods=True):
+        """
+        Vectorized version of the pod merge in _query_pods, the metrics are joined on the pod name in one step.
+        """
+        frames = [
+            self._pod_frame(results.get("cpu", []), "cpu"),
+            self._pod_frame(results.get("memory", []), "memory"),
+            self._pod_frame(results.get("kepler", []), "kepler", pod_label="pod_name", node_or_instance_label="node"),
+            self._scaphandre_frame(results.get("scaphandre", []), pod_index, namespace),
+        ]
+        network = self._pod_frame(results.get("network", []), "network")
+        joined = pd.concat(frames, axis=1, join="outer").join(network[["network"]], how="left")
+
+        if validate_pods:
+            # Validate that the pods actually exist in the current cluster
+            current_pods = self._get_current_pod_names(namespace)
+            stale = np.array([name not in current_pods for name in joined.index.tolist()], dtype=bool)
+            if stale.any():
+                logger.debug(f"Skipping metrics for {stale.sum()} pods not found in current cluster (likely stale metrics)")
+                joined = joined[~stale]
+
+        # XXX warning assumption instance is the same for all metrics, otherwise the first available is used
+        instances = [joined[f"{m}_instance"].where(joined[f"{m}_instance"] != "unknown") for m in self.POD_METRICS]
+        instance = instances[0]
+        for other in instances[1:]:
+            instance = instance.fillna(other)
+        mismatch = np.logical_or.reduce([(other.notna() & (other != instance)).to_numpy() for other in instances])
+        if mismatch.any():
+            logger.warning(f"Instance mismatch for pods {list(joined.index[mismatch])}, using first available")
+        joined["instance"] = instance
+        missing = joined["instance"].isna()
+        if missing.any():
+            logger.warning(f"No valid instance found for pods {list(joined.index[missing])}, skipping")
+            joined = joined[~missing]
+
+        observation_time = joined[[f"{m}_timestamp" for m in self.POD_METRICS]].min(axis=1).fillna(time.time()).astype(np.int64)
+        values = joined[self.POD_METRICS + ["network"]].fillna(0.0)
+
+        pods = []
+        # plain lists, iterating pandas columns element-wise is slow
+        for name, instance, observed, cpu, memory, kepler, scaphandre, network_usage in zip(
+                joined.index.tolist(), joined["instance"].tolist(), observation_time.tolist(),
+                *(values[m].tolist() for m in self.POD_METRICS + ["network"])):
+            pod = PodUsage()
+            pod.collection_time = collection_time
+            pod.observation_time = observed
+            pod.name = name
+            pod.namespace = namespace
+            pod.cpu_usage = cpu
+            pod.memory_usage = memory
+            pod.network_usage = network_usage
+            pod.instance = instance
+            pod.kepler_consumtion = kepler
+            pod.scaphandre_consumtion = scaphandre
             pods.append(pod)
         return pods
 
@@ -362,8 +662,8 @@ class ResourceTracker:
                 logger.warning("metric has neither instance nor node info: %s", node)
                 continue
             results[name] = {
-                "timestamp": datetime.datetime.fromtimestamp(node['value'][0]),
-                "value": node['value'][1]
+                "timestamp": int(node['value'][0]),
+                "value": float(node['value'][1])
             }
         return results
 
@@ -375,8 +675,8 @@ class ResourceTracker:
                 pod_name = metric_labels[pod_label]
                 node_name = metric_labels.get('node', metric_labels.get(node_or_instance_label, "unknown"))
                 results[pod_name] = {
-                    "timestamp": datetime.datetime.fromtimestamp(pod_metric['value'][0]),
-                    "value": pod_metric['value'][1],
+                    "timestamp": int(pod_metric['value'][0]),
+                    "value": float(pod_metric['value'][1]),
                     "instance": node_name
                 }
             else:
@@ -384,7 +684,7 @@ class ResourceTracker:
                 continue
         return results
     
-    def get_scaphandre_metrics(self,_results, pod_index={}):
+    def get_scaphandre_metrics(self,_results, pod_index={}, namespace=None):
         results = {}
         
         for pod in _results:
@@ -392,63 +692,137 @@ class ResourceTracker:
                 continue # not sure what these metrics are ...
             container_id = pod['metric']['container_id']
             if container_id in pod_index:
-                pod_name = pod_index[container_id]["name"]
+                entry = pod_index[container_id]
             elif container_id.startswith("cri-containerd-") and container_id[15:] in pod_index:
-                pod_name = pod_index[container_id[15:]]["name"]
+                entry = pod_index[container_id[15:]]
             else:
                 continue
+            # the series have no namespace label, containers of pods in other namespaces belong to their own namespace
+            if namespace is not None and entry["namespace"] != namespace:
+                continue
+            pod_name = entry["name"]
             results[pod_name] = {
-                "timestamp":datetime.datetime.fromtimestamp(pod['value'][0]),
-                "value":pod['value'][1],
+                "timestamp":int(pod['value'][0]),
+                "value":float(pod['value'][1]),
                 "instance":pod['metric']['node']
             }
         return results
 
     def track(self):
         if self.prm:
-            # Refresh node mapping before each tracking cycle
-            self._refresh_node_map()
+            cycle_start = time.monotonic()
+            # the effective interval of the samples, the time span they represent
+            interval = round(cycle_start - self._last_tick, 3) if self._last_tick is not None else self.timer.interval
+            self._last_tick = cycle_start
+            # Refresh node mapping if it expired
+            self._ensure_node_map()
             
             pod_index = self.fetch_pods()
-            nodes = self._query_nodes()
+
+            queries = {("nodes", key): query for key, query in self._node_queries().items()}
+            if self.batch_namespaces:
+                queries.update({("pods", key): query for key, query in self._batched_pod_queries(self.namespaces, pod_index).items()})
+            else:
+                for namespace in self.namespaces:
+                    queries.update({(namespace, key): query for key, query in self._pod_queries(namespace, pod_index).items()})
+            # fanned out at once in concurrent mode, otherwise one after another
+            results = self._execute_queries(queries)
+
+            node_results = {key: result for (scope, key), result in results.items() if scope == "nodes"}
+            pod_results = {}
+            if self.batch_namespaces:
+                batched_results = {key: result for (scope, key), result in results.items() if scope == "pods"}
+                for namespace in self.namespaces:
+                    pod_results[namespace] = self._split_by_namespace(batched_results, namespace)
+            else:
+                for namespace in self.namespaces:
+                    pod_results[namespace] = {key: result for (scope, key), result in results.items() if scope == namespace}
+
+            nodes = self._query_nodes(node_results)
             for node in nodes:
+                node.interval = interval
                 self.node_channel.put(node)
                 
             pods = []
             for namespace in self.namespaces:
-                pods = pods + self._query_pods(namespace, pod_index)
+                pods = pods + self._query_pods(namespace, pod_index, pod_results[namespace])
 
             #insert the data
             for p in pods:
+                p.interval = interval
                 self.pod_channel.put(p)
 
+            # the samples of the complete tick, replaced at once for readers in other threads
+            self.last_samples = (nodes, pods)
+
+            if self.adaptive_interval is not None:
+                self.timer.interval = self.adaptive_interval.next(nodes)
+            self._record_cycle(time.monotonic() - cycle_start)
+
+    def _record_cycle(self, duration: float):
+        self.last_cycle_duration = duration
+        self.max_cycle_duration = max(self.max_cycle_duration, duration)
+        # overruns of the interval are reported by the scheduler
+        logger.debug(f"Tracking cycle took {duration:.2f}s (interval {self.timer.interval}s)")
+
+    def backfill(self, start: datetime.datetime, end: datetime.datetime, step=None):
+        """
+        Collect the node and pod metrics of a completed run with one range query per metric
+        and put evenly spaced samples (every step seconds, defaults to the update interval) into the channels.
+        Samples are not validated against the live pods, containers are resolved against the current pod index.
+        """
+        if not self.prm:
+            return
+        step = step or self.UPDATE_INTERVAL
+        pod_index = self.fetch_pods()
+
+        queries = {("nodes", key): query for key, query in self._node_queries().items()}
+        queries.update({("pods", key): query for key, query in self._batched_pod_queries(self.namespaces, pod_index).items()})
+        results = self._execute_queries(queries, start=start, end=end, step=step)
+
+        # regroup the matrix results into one instant vector per evaluation timestamp
+        samples = defaultdict(lambda: defaultdict(list))
+        for key, result in results.items():
+            for series in result:
+                for timestamp, value in series.get("values", []):
+                    samples[timestamp][key].append({"metric": series["metric"], "value": [timestamp, value]})
+
+        num_nodes, num_pods = 0, 0
+        for timestamp in sorted(samples):
+            sample = samples[timestamp]
+            collection_time = int(timestamp)
+            node_results = {key: sample[("nodes", key)] for key in self._node_queries()}
+            for node in self._query_nodes(node_results, collection_time):
+                node.interval = step
+                self.node_channel.put(node)
+                num_nodes += 1
+            pod_results = {key: sample[("pods", key)] for key in self._batched_pod_queries(self.namespaces)}
+            for namespace in self.namespaces:
+                namespace_results = self._split_by_namespace(pod_results, namespace)
+                for pod in self._query_pods(namespace, pod_index, namespace_results, collection_time, validate_pods=False):
+                    pod.interval = step
+                    self.pod_channel.put(pod)
+                    num_pods += 1
+        logger.info(f"Backfilled {num_nodes} node and {num_pods} pod samples from {start} to {end} in {len(samples)} steps of {step}s")
+
     def start(self):
         if self.prm:
             logger.debug("Starting resource tracker.")
+            if self.adaptive_interval is not None:
+                self.timer.interval = self.adaptive_interval.interval
             self.timer.start()
 
     def stop(self):
         if self.prm:
             logger.debug("Stopping resource tracker.")
             self.timer.cancel()
-
-
-class FixedQueue(Queue):
-    """
-    A fixed size queue that removes the oldest item when a new one is added if the queue is full.
-    """
-    def __init__(self, size):
-        super().__init__()
-        self.maxsize = size
-
-    def put(self, item):
-        if super().full():
-            super().get_nowait()
-        super().put(item)
-
-    def take(self, n):
-        for _ in range(n):
-            yield super().get()
-
-    def elements(self):
-        return copy.deepcopy(self.queue)
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            if self.pod_index is not None:
+                self.pod_index.stop()
+            if self.last_cycle_duration is not None:
+                stats = self.timer.stats()
+                logger.info(
+                    f"Resource tracker stopped after {stats['ticks']} ticks, slowest tracking cycle took {self.max_cycle_duration:.2f}s, "
+                    f"{stats['skipped']} ticks skipped in {stats['overruns']} overruns, tick jitter mean {stats['mean_jitter'] * 1000:.1f}ms max {stats['max_jitter'] * 1000:.1f}ms"
+                )
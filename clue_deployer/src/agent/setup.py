@@ -19,10 +19,13 @@ setup(
     packages=["psc"],
     install_requires=[
         "prometheus-api-client",
+        "pandas",
+        "numpy",
         "kubernetes",
         "flask",
         "flask-sock",
-        "gunicorn"
+        "gunicorn",
+        "gevent"
     ],
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -1,7 +1,12 @@
-from psc import FixedQueue, NodeUsage
+from psc import FixedQueue, NodeUsage, PodUsage, ResourceTracker
+from psc.adaptive_interval import AdaptiveInterval
+from clue_deployer.src.flushing_queue import FlushingQueue
 from datetime import datetime
+import os
 import random
-import uuid
+import shutil
+import tempfile
+import time
 
 from sys import getsizeof, stderr,exit
 from itertools import chain
@@ -51,34 +56,233 @@ def _total_size(o, handlers={}, verbose=False):
 
     return sizeof(o)
 
+class LegacyPodUsage:
+    """
+    The pod sample as it was stored before __slots__: a per-instance __dict__,
+    string values copied from the Prometheus JSON and datetime timestamps.
+    """
+    def __init__(self):
+        self.collection_time = None
+        self.observation_time = None
+        self.name = None
+        self.namespace = None
+        self.cpu_usage = None
+        self.memory_usage = None
+        self.network_usage = None
+        self.instance = None
+        self.kepler_consumtion = None
+        self.scaphandre_consumtion = None
+
 def total_size(o):
     handlers = {
-        NodeUsage: lambda n: chain.from_iterable(n.processes),
+        NodeUsage: lambda n: (getattr(n, s) for s in NodeUsage.__slots__),
+        PodUsage: lambda p: (getattr(p, s) for s in PodUsage.__slots__),
+        LegacyPodUsage: lambda p: [p.__dict__],
         FixedQueue: lambda q: q.elements()
     }
     return _total_size(o,handlers=handlers,verbose=False)
 
-def test_fixed_queue(size=100, max_process=96):
+def random_pod(legacy=False):
+    now = time.time()
+    if legacy:
+        p = LegacyPodUsage()
+        p.collection_time = datetime.fromtimestamp(int(now))
+        p.observation_time = datetime.fromtimestamp(int(now))
+        p.cpu_usage = str(random.random())
+        p.memory_usage = str(random.random()*8000)
+        p.network_usage = str(random.random())
+        p.kepler_consumtion = str(random.random()*100)
+        p.scaphandre_consumtion = str(random.random()*100)
+    else:
+        p = PodUsage()
+        p.collection_time = int(now)
+        p.observation_time = int(now)
+        p.cpu_usage = float(str(random.random()))
+        p.memory_usage = float(str(random.random()*8000))
+        p.network_usage = float(str(random.random()))
+        p.kepler_consumtion = float(str(random.random()*100))
+        p.scaphandre_consumtion = float(str(random.random()*100))
+    p.name = f"teastore-webui-{random.randint(0, 99999):05d}"
+    p.namespace = "tea-bench"
+    p.instance = f"node-{random.randint(0, 3)}"
+    return p
+
+def test_fixed_queue(size=100, legacy=False):
     start = datetime.now()
     q = FixedQueue(size)
     for i in range(size):
-        n = NodeUsage(str(i)) 
-        n.timestamp = datetime.now()
-        n.cpu_usage = random.random()
-        n.memory_usage = random.randint(100,8000)
-        n.network_usage = random.random()
-        n.wattage = random.random()*100000
-        for i in range(0,random.randint(1,max_process)):
-            n.processes.append((str(uuid.uuid4()),random.random()))
-        q.put(n)
+        q.put(random_pod(legacy))
     dur = datetime.now()-start
-    print(f"{size},{max_process} took:\t {dur.total_seconds()}, size:\t {total_size(q)} bytes")
+    total = total_size(q)
+    label = "legacy" if legacy else "slots"
+    print(f"{label} {size} took:\t {dur.total_seconds()}, size:\t {total} bytes, {total/size:.0f} bytes/sample")
+
+class StubCatalogue:
+    """Only the pod cpu and scaphandre queries, the query string is the key of the stubbed result."""
+    def node_queries(self):
+        return {}
+
+    def pod_queries(self, namespaces, batched=False):
+        return {"cpu": "cpu", "scaphandre": "scaphandre"}
+
+    def scaphandre_query(self, selector):
+        return "scaphandre"
+
+class StubPrometheus:
+    """Range results of podA in nsA and podB in nsB, the scaphandre series carry no namespace label."""
+    def custom_query_range(self, query, start_time, end_time, step):
+        series = {
+            "cpu": [
+                {"metric": {"namespace": "nsA", "pod": "podA", "instance": "node-0"}, "values": [[100, "0.5"]]},
+                {"metric": {"namespace": "nsB", "pod": "podB", "instance": "node-1"}, "values": [[100, "0.25"]]},
+            ],
+            "scaphandre": [
+                {"metric": {"container_id": "cri-containerd-cidA", "node": "node-0"}, "values": [[100, "2.0"]]},
+                {"metric": {"container_id": "cidB", "node": "node-1"}, "values": [[100, "3.0"]]},
+            ],
+        }
+        return series[query]
+
+def test_backfill_namespaces(vectorized=False):
+    """The scaphandre wattage of a pod is only backfilled in the namespace of the pod."""
+    rt = ResourceTracker.__new__(ResourceTracker)
+    rt.prm = StubPrometheus()
+    rt.catalogue = StubCatalogue()
+    rt.namespaces = ["nsA", "nsB"]
+    rt.UPDATE_INTERVAL = 10
+    rt.vectorized = vectorized
+    rt.filter_scaphandre = False
+    rt._executor = None
+    rt.node_map = {}
+    rt.node_map_ttl = 300
+    rt._node_map_refreshed = time.monotonic()
+    rt.node_channel = FixedQueue(10)
+    rt.pod_channel = FixedQueue(10)
+    pod_index = {
+        "cidA": {"name": "podA", "namespace": "nsA", "containers": [{"cid": "cidA"}]},
+        "cidB": {"name": "podB", "namespace": "nsB", "containers": [{"cid": "cidB"}]},
+    }
+    rt.fetch_pods = lambda: pod_index
+    rt.backfill(datetime.fromtimestamp(100), datetime.fromtimestamp(100))
+
+    pods = sorted((p.namespace, p.name, p.cpu_usage, p.scaphandre_consumtion) for p in rt.pod_channel.elements())
+    assert pods == [("nsA", "podA", 0.5, 2.0), ("nsB", "podB", 0.25, 3.0)], pods
+    print(f"backfill {'vectorized' if vectorized else 'dict'} namespaces:\t ok")
+
+class NodePrometheus:
+    """Instant node results of two instances, kepler and scaphandre are keyed by the node name."""
+    def __init__(self):
+        self.node_info_queries = 0
+
+    def get_current_metric_value(self, metric):
+        self.node_info_queries += 1
+        return [
+            {"metric": {"node": "node-a", "internal_ip": "10.0.0.1"}},
+            {"metric": {"node": "node-b", "internal_ip": "10.0.0.2"}},
+        ]
+
+def node_results(now):
+    by_instance = [{"metric": {"instance": f"10.0.0.{i}:9100"}, "value": [now, "1.0"]} for i in (1, 2)]
+    by_node = [{"metric": {"node": node}, "value": [now, "5.0"]} for node in ("node-a", "node-b")]
+    return {"cpu": by_instance, "memory": by_instance, "kepler": by_node, "scaphandre": by_node}
+
+def test_node_map_ttl(ticks=5):
+    """Within the ttl the node map is only refreshed for instances it does not know, not for every tick."""
+    rt = ResourceTracker.__new__(ResourceTracker)
+    rt.prm = NodePrometheus()
+    rt.available_metrics = {"kube_node_info"}
+    # every tick is past the update interval, an unknown instance would refresh the map on each of them
+    rt.UPDATE_INTERVAL = 0
+    rt.node_map_ttl = 300
+    rt.node_map = {}
+    rt._refresh_node_map()
+    for tick in range(ticks):
+        nodes = rt._query_nodes(node_results(100 + tick), collection_time=100 + tick)
+        assert sorted((n.instance, n.wattage_kepler) for n in nodes) == [("10.0.0.1:9100", 5.0), ("10.0.0.2:9100", 5.0)]
+    assert rt.prm.node_info_queries == 1, rt.prm.node_info_queries
+
+    # an instance that is not in the map yet refreshes it
+    results = node_results(200)
+    results["cpu"] = results["cpu"] + [{"metric": {"instance": "10.0.0.3:9100"}, "value": [200, "1.0"]}]
+    rt._query_nodes(results, collection_time=200)
+    assert rt.prm.node_info_queries == 2, rt.prm.node_info_queries
+    print(f"node map refreshes in {ticks} ticks:\t ok")
+
+def test_parquet_spool(background=False, samples=100):
+    """The pod samples of a parquet queue are readable while the run is in progress and after close()."""
+    import pandas as pd
+    folder = tempfile.mkdtemp(prefix="clue-queue-")
+    try:
+        filename = os.path.join(folder, "measurements_pod_test.parquet")
+        q = FlushingQueue(filename, buffer_size=32, fields=PodUsage._fields, background=background,
+                          output_format="parquet", types=PodUsage._types)
+        for _ in range(samples):
+            q.put(random_pod())
+        q.flush()
+        # a run killed now keeps every flushed sample in the CSV spool
+        spooled = pd.read_csv(os.path.join(folder, "measurements_pod_test.csv"))
+        assert len(spooled) >= samples - 32, len(spooled)
+        q.close()
+        assert os.listdir(folder) == ["measurements_pod_test.parquet"], os.listdir(folder)
+        written = pd.read_parquet(filename)
+        assert len(written) == samples and list(written.columns) == PodUsage._fields, written.dtypes
+        assert str(written["collection_time"].dtype).startswith("datetime64"), written.dtypes
+    finally:
+        shutil.rmtree(folder)
+    print(f"parquet spool {'background' if background else 'sync'}:\t ok")
+
+def test_stage_transitions():
+    """The stage changes of the teastore shapes and of the toystore / otel-demo rampup shapes are announced."""
+    for key in AdaptiveInterval.STAGE_DURATION_SETTINGS:
+        adaptive = AdaptiveInterval(2, 30)
+        adaptive.announce_load_shape(1000, {key: 60}, runtime=200)
+        assert adaptive._transitions == [(1060, 1062), (1120, 1122), (1180, 1182)], (key, adaptive._transitions)
+        # within a stage the interval grows, it tightens again for the next stage change
+        assert adaptive.next([], now=1070) == 4 and adaptive.next([], now=1119) == 2 and adaptive.next([], now=1121) == 2
+    print(f"stage transitions of {', '.join(AdaptiveInterval.STAGE_DURATION_SETTINGS)}:\t ok")
+
+class StubWebsocket:
+    """Records the sent messages, disconnects after limit messages."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.messages = []
+
+    @property
+    def connected(self):
+        return len(self.messages) < self.limit
+
+    def send(self, message):
+        self.messages.append(message)
+
+def test_late_csv_client():
+    """A csv stream client that connects late only receives the rows added after it connected."""
+    import threading
+    import agent
+    channel = FixedQueue(100)
+    for _ in range(10):
+        channel.put(random_pod())
+    ws = StubWebsocket(limit=3)
+    client = threading.Thread(target=agent.sent_csv, args=(ws, channel, PodUsage._fields), daemon=True)
+    client.start()
+    while not ws.messages:
+        time.sleep(0.01)
+    live = [random_pod(), random_pod()]
+    for p in live:
+        channel.put(p)
+    client.join(timeout=10)
+    assert not client.is_alive(), ws.messages
+    assert ws.messages[1:] == [",".join(str(p.to_dict()[f]) for f in PodUsage._fields) for p in live], ws.messages
+    print("late csv client:\t ok")
 
 if __name__ == '__main__':
-    test_fixed_queue()
-    test_fixed_queue(1000)
-    test_fixed_queue(1000,1000)
-    test_fixed_queue(100000)
+    for size in [100, 1000, 8192]:
+        test_fixed_queue(size, legacy=True)
+        test_fixed_queue(size)
+    test_backfill_namespaces()
+    test_backfill_namespaces(vectorized=True)
+    test_node_map_ttl()
+    test_parquet_spool()
+    test_parquet_spool(background=True)
+    test_stage_transitions()
+    test_late_csv_client()
     exit(0)
-
-        
\ No newline at end of file
@@ -1,4 +1,5 @@
 from pathlib import Path
+from pydantic import Field
 from pydantic_settings import BaseSettings
 import yaml
 
@@ -13,6 +14,28 @@ class ClueConfig(BaseSettings):
     local_platform_arch: str
     docker_registry_address: str
     target_utilization: int
+    # Resource tracker
+    tracker_concurrent_queries: bool = Field(default=False)
+    tracker_max_workers: int = Field(default=8)
+    tracker_batch_namespaces: bool = Field(default=False)
+    tracker_backfill: bool = Field(default=False)
+    tracker_watch_pods: bool = Field(default=False)
+    tracker_node_map_ttl: int = Field(default=300)
+    tracker_vectorized: bool = Field(default=False)
+    tracker_filter_scaphandre: bool = Field(default=False)
+    tracker_metrics: dict = Field(default_factory=dict)
+    tracker_recording_rules: bool = Field(default=False)
+    tracker_adaptive_interval: bool = Field(default=False)
+    tracker_min_interval: float = Field(default=2)
+    tracker_max_interval: float = Field(default=30)
+    tracker_change_threshold: float = Field(default=0.2)
+    tracker_background_writer: bool = Field(default=False)
+    tracker_fsync: str = Field(default="never")
+    tracker_output_format: str = Field(default="csv")
+    # Workload results
+    results_codec: str = Field(default="gzip")
+    results_load_workers: int = Field(default=1)
+    results_cache: bool = Field(default=False)
     
     class Config:
         # Allow environment variable overrides
@@ -1,28 +1,236 @@
 import os
-from csv import DictWriter
-from queue import Empty, Queue
+import threading
+from csv import writer as csv_writer
+from queue import Empty, Full, Queue
+from clue_deployer.src.logger import logger
+
+# fsync policies of the background writer
+FSYNC_NEVER = "never"
+FSYNC_BATCH = "batch"
+FSYNC_CLOSE = "close"
+
+# output formats
+FORMAT_CSV = "csv"
+FORMAT_PARQUET = "parquet"
+
+_CLOSE = object()
+
+
+class _CsvOutput:
+    """Appends rows to a CSV file, the header is written if the file is new."""
+
+    def __init__(self, filename: str, fields: list, types: dict):
+        self._file = open(filename, "a")
+        self._writer = csv_writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(fields)
+
+    def write(self, rows: list):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def close(self, sync=False):
+        if sync:
+            self.sync()
+        self._file.close()
+
+
+class _ParquetOutput:
+    """
+    Writes a typed Parquet file. Fields are float64 unless types says string or timestamp (naive datetimes,
+    stored in seconds). A Parquet file is only readable once its footer is written, so the rows are appended to
+    a CSV spool next to it (the same name ending in .csv) while the run is in progress. close() converts the
+    spool into row groups of ROW_GROUP_SIZE rows and removes it. A run that crashes or is killed keeps its
+    measurements in the spool, which is loaded like any CSV measurement file.
+    """
+
+    ROW_GROUP_SIZE = 8192
+
+    def __init__(self, filename: str, fields: list, types: dict):
+        import pyarrow as pa
+        arrow_types = {"string": pa.string(), "timestamp": pa.timestamp("s")}
+        self._schema = pa.schema([(field, arrow_types.get(types.get(field), pa.float64())) for field in fields])
+        self.filename = filename
+        self.spool_filename = spool_path(filename)
+        self._spool = _CsvOutput(self.spool_filename, fields, types)
+
+    def write(self, rows: list):
+        self._spool.write(rows)
+
+    def sync(self):
+        self._spool.sync()
+
+    def close(self, sync=False):
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+        self._spool.close(sync=sync)
+        # sub-second timestamps are parsed and truncated to seconds, strings keep empty values as nulls
+        read_types = {field.name: pa.timestamp("us") if pa.types.is_timestamp(field.type) else field.type for field in self._schema}
+        table = pa_csv.read_csv(
+            self.spool_filename,
+            convert_options=pa_csv.ConvertOptions(column_types=read_types, strings_can_be_null=True),
+        )
+        table = table.select(self._schema.names).cast(self._schema, safe=False)
+        with open(self.filename + ".tmp", "wb") as f:
+            pq.write_table(table, f, row_group_size=self.ROW_GROUP_SIZE)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(self.filename + ".tmp", self.filename)
+        os.remove(self.spool_filename)
+
+
+def spool_path(filename: str) -> str:
+    """The CSV spool of a Parquet measurement file, the rows of a run that did not complete remain there."""
+    return os.path.splitext(filename)[0] + ".csv"
+
+
+_OUTPUTS = {FORMAT_CSV: _CsvOutput, FORMAT_PARQUET: _ParquetOutput}
 
 
 class FlushingQueue(Queue):
-    def __init__(self, filename: str, buffer_size=60, fields=[]) -> None:
-        super().__init__(2 * buffer_size)
+    """
+    Buffers samples and appends them as rows to a CSV or Parquet file.
+
+    By default puts flush the buffer synchronously once buffer_size samples are queued.
+    In background mode a writer thread owns the file handle for the whole run and writes the samples in batches
+    of up to buffer_size rows, puts only hand the sample over (at most max_pending samples are queued).
+    The fsync policy (never, batch, close) decides when the written rows are forced to disk.
+    If the writer thread fails (e.g. the file can not be opened), puts, flush and close raise its error instead of blocking.
+    Parquet rows are spooled to a CSV file while the run is in progress and converted at close(), a run that
+    does not complete keeps its rows in the CSV spool.
+    """
+
+    # seconds between the checks of the writer thread while a put, flush or close waits for it
+    WRITER_CHECK_INTERVAL = 1
+
+    def __init__(self, filename: str, buffer_size=60, fields=[], background=False, fsync=FSYNC_NEVER, max_pending=10000,
+                 output_format=FORMAT_CSV, types={}) -> None:
+        if fsync not in (FSYNC_NEVER, FSYNC_BATCH, FSYNC_CLOSE):
+            raise ValueError(f"Unknown fsync policy {fsync}")
+        if output_format not in _OUTPUTS:
+            raise ValueError(f"Unknown output format {output_format}, supported formats are {list(_OUTPUTS)}")
+        super().__init__(max_pending if background else 2 * buffer_size)
         self.buffer_size = buffer_size
         self.filename = filename
         self.fields = fields
+        self.background = background
+        self.fsync = fsync
+        self.output_format = output_format
+        self.types = types
+        self._output = None
+        self._closed = False
+        self._writer = None
+        # the exception the writer thread failed with
+        self._error = None
+        if background:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True, name=f"writer-{os.path.basename(filename)}")
+            self._writer.start()
 
     def put(self, item):
+        if self.background:
+            if self._closed:
+                logger.debug(f"Dropping sample for {self.filename}, the queue is closed")
+                return
+            self._handover(item)
+            return
         if self.qsize() >= self.buffer_size:
             self.flush()
         super().put(item)
 
     def flush(self):
+        if self.background:
+            # wait until the writer wrote everything that was queued so far
+            with self.all_tasks_done:
+                while self.unfinished_tasks:
+                    self._check_writer()
+                    self.all_tasks_done.wait(self.WRITER_CHECK_INTERVAL)
+            return
+        if self.output_format != FORMAT_CSV:
+            # the parquet output keeps its spool open until close() converts it
+            if self._output is None:
+                self._output = _OUTPUTS[self.output_format](self.filename, self.fields, self.types)
+            self._output.write([item.to_row() for item in self._take(self.buffer_size)])
+            return
         if not os.path.isfile(self.filename):
             with open(self.filename, "w") as f:
-                DictWriter(f, fieldnames=self.fields).writeheader()
+                csv_writer(f).writerow(self.fields)
         with open(self.filename, "a") as f:
-            writer = DictWriter(f, fieldnames=self.fields)
-            for _ in range(self.buffer_size):
-                try:
-                    writer.writerow(self.get(block=False, timeout=None).to_dict())
-                except Empty:
-                    break
+            writer = csv_writer(f)
+            for item in self._take(self.buffer_size):
+                # rows are written in the order of the sample's _fields
+                writer.writerow(item.to_row())
+
+    def _take(self, n):
+        items = []
+        for _ in range(n):
+            try:
+                items.append(self.get(block=False))
+            except Empty:
+                break
+        return items
+
+    def close(self):
+        """Write all queued samples and release the file, further samples are dropped. Can be called more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        if not self.background:
+            while not self.empty():
+                self.flush()
+            if self.output_format != FORMAT_CSV:
+                if self._output is None:
+                    # an empty file with the schema
+                    self._output = _OUTPUTS[self.output_format](self.filename, self.fields, self.types)
+                self._output.close(sync=self.fsync != FSYNC_NEVER)
+            return
+        self._handover(_CLOSE)
+        self._writer.join()
+        self._check_writer()
+
+    def _handover(self, item):
+        """Queue an item for the writer thread, waits while max_pending samples are queued as long as the writer runs."""
+        while True:
+            self._check_writer()
+            try:
+                super().put(item, timeout=self.WRITER_CHECK_INTERVAL)
+                return
+            except Full:
+                continue
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError(f"The writer of {self.filename} failed") from self._error
+        if not self._writer.is_alive() and self.unfinished_tasks:
+            raise RuntimeError(f"The writer of {self.filename} stopped with {self.unfinished_tasks} samples queued")
+
+    def _write_loop(self):
+        try:
+            self._write_samples()
+        except BaseException as e:
+            logger.error(f"The writer of {self.filename} failed: {e}")
+            self._error = e
+
+    def _write_samples(self):
+        output = _OUTPUTS[self.output_format](self.filename, self.fields, self.types)
+        closing = False
+        while not closing:
+            batch = [self.get()]
+            batch += self._take(self.buffer_size - 1)
+            closing = any(item is _CLOSE for item in batch)
+            items = [item for item in batch if item is not _CLOSE]
+            try:
+                # rows are written in the order of the sample's _fields
+                output.write([item.to_row() for item in items])
+                if self.fsync == FSYNC_BATCH:
+                    output.sync()
+            except Exception as e:
+                logger.error(f"Failed to write {len(items)} samples to {self.filename}: {e}")
+            finally:
+                for _ in batch:
+                    self.task_done()
+        output.close(sync=self.fsync != FSYNC_NEVER)
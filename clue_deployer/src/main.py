@@ -16,6 +16,7 @@ from clue_deployer.src.models.variant import Variant
 from clue_deployer.src.variant_runner import VariantRunner
 from clue_deployer.src.models.workload import Workload
 from clue_deployer.src.variant_deployer import VariantDeployer
+from clue_deployer.src.results.manifest import ResultsManifest
 from clue_deployer.src.logger import process_logger as logger
 
 # Disable SSL verification
@@ -150,6 +151,9 @@ class ExperimentRunner:
                 status_data = {"status": "SUCCESS"}
                 with open(status_file_path, 'w') as f:
                     json.dump(status_data, f, indent=2)
+                # Index the result files of the completed runs next to the experiment.json
+                logger.info("Updating the manifest.json in the results folder")
+                ResultsManifest.scan(results_parent_path).write()
                 # Additional wait after each iteration except the last one
                 if iteration < num_iterations - 1:
                     logger.info(f"Sleeping {CONFIGS.sut_config.wait_after_workloads} seconds before next iteration")
@@ -7,7 +7,7 @@ import glasbey
 import numpy as np
 import warnings
 import yaml
-from clue_deployer.src.results.experiment_results import ExperimentResults
+from clue_deployer.src.results.experiment_results import ExperimentResults, map_names
 import dash
 from dash import dash_table
 import pandas as pd
@@ -106,6 +106,11 @@ class DataAnalysis:
         }
     }
 
+    # the measurement columns the analysis uses, ExperimentResults adds the ones its frames need
+    # Parquet measurements only read these columns from disk
+    POD_COLUMNS = ["cpu_usage", "memory_usage", "network_usage", "wattage_kepler", "wattage_scaph", "observation_time", "collection_time"]
+    NODE_COLUMNS = ["cpu_usage", "memory_usage", "wattage_kepler", "wattage_scaph"]
+
     warnings.filterwarnings('ignore')
     pd.set_option('display.max_columns', None)
     sns.set_theme(rc={'figure.figsize':(12, 6)})
@@ -131,9 +136,13 @@ class DataAnalysis:
 
     
     
-    def __init__(self, experiment_folder: str, config_file_path: str, sut_name: str, load_from_hdf5: bool = False, hdf5_path: Optional[str] = None):
+    def __init__(self, experiment_folder: str, config_file_path: str, sut_name: str, load_from_hdf5: bool = False, hdf5_path: Optional[str] = None, load_workers: Optional[int] = None, cache: bool = False):
         # Read the configs and experiment details
         self.sut = sut_name
+        # worker processes that parse the raw result files, serial loading if not set
+        self.load_workers = load_workers
+        # keep the parsed results in <experiment_folder>/.cache, reopening an unchanged experiment does not parse it again
+        self.cache = cache
         self.service_pods = []
         sut_config_yaml = self.parse_sut_yaml(config_file_path)
         self.general_allowance = sut_config_yaml["default_resource_limits"]
@@ -265,13 +274,14 @@ class DataAnalysis:
 
     def load_from_raw(self, experiment_folder: str) -> None:
         """Load data from raw format using ExperimentResults."""
-        exr = ExperimentResults(experiment_folder, load_stats_history=True, sut=self.sut, remove_outliers=True)
+        exr = ExperimentResults(experiment_folder, load_stats_history=True, sut=self.sut, remove_outliers=True, workers=self.load_workers, cache=self.cache,
+                                node_columns=self.NODE_COLUMNS, pod_columns=self.POD_COLUMNS)
         self.stats_history_aggregated_data = exr.stats_history_aggregated
         self.pods_data = exr.pods
         self.stats_data = exr.stats
         self.nodes_data = exr.nodes
-        self.pods_energy_data = exr.pods_energy()
-        self.run_stats_data = exr.run_stats()
+        self.pods_energy_data = exr.cached("pods_energy", exr.pods_energy)
+        self.run_stats_data = exr.cached("run_stats", exr.run_stats)
 
     def create_metrics(self):
         failures = self.get_failures()
@@ -377,7 +387,7 @@ class DataAnalysis:
 
     def get_pods_usage(self, namespace:str):
         pods = self.pods_data[self.pods_data["namespace"] == namespace]
-        pods["pod_name"] = pods["name"].apply(lambda x: "-".join(x.split("-")[0:2]))
+        pods["pod_name"] = self.service_names(pods["name"])
 
         #TODO: Find a way to generalize this
         #pods["type"] = pods["pod_name"].apply(
@@ -442,7 +452,7 @@ class DataAnalysis:
         return row
     
     def get_real_utilization(self, pods):
-        pods["type"] = pods["name"].apply(lambda x: "-".join(x.split("-")[0:2]))
+        pods["type"] = self.service_names(pods["name"])
         pod_scale_behavior = pods.groupby(DataAnalysis.run_vars + ["run_time", "type"])["type"].count().reset_index(name="count")
 
         pod_resouce_utilization = pod_scale_behavior.apply(self.calulate_resouce_allowence, axis=1)
@@ -471,24 +481,34 @@ class DataAnalysis:
         real_total_utilization.reset_index(inplace=True)
         return real_total_utilization
 
-    def calculate_cost(row):
-        # meory * cpu_seconds * price_per_memory_second + wattage * kwh_price
-        return row['memory_usage'] * DataAnalysis.memory_second_price + np.ceil(row["cpu_usage"]) * DataAnalysis.vCPU_second_price + (
-                    row["wattage_kepler"] * DataAnalysis.ws_price)
+    @staticmethod
+    def service_names(names: pd.Series) -> pd.Series:
+        """The service of every pod name, its first two dash separated parts (teastore-webui-5d8f9-x2k4 -> teastore-webui)."""
+        return map_names(names, lambda n: n.str.split("-", n=2).str[:2].str.join("-"))
+
+    @staticmethod
+    def calculate_cost(usage):
+        # meory * cpu_seconds * price_per_memory_second + wattage * kwh_price, of every row of the usage frame
+        return usage['memory_usage'] * DataAnalysis.memory_second_price + np.ceil(usage["cpu_usage"]) * DataAnalysis.vCPU_second_price + (
+                    usage["wattage_kepler"] * DataAnalysis.ws_price)
 
-    def calculate_memory_usage(self, row):
-        return row['memory_usage'] * self.node_model[row['instance']]
+    def calculate_memory_usage(self, nodes):
+        # memory_usage of the nodes is the used fraction of the node memory (MB)
+        node_memory = map_names(nodes['instance'], lambda instances: instances.map(self.node_model))
+        if node_memory.isna().any():
+            raise KeyError(f"No memory size of the nodes {sorted(nodes['instance'][node_memory.isna().to_numpy()].unique())}")
+        return nodes['memory_usage'] * node_memory.astype(float)
 
     def get_runtime_overhead_costs(self, nodes):
         nodes = self.nodes_data[(self.nodes_data['instance'].isin(self.pods_data['instance'].unique()))].copy()
     
-        nodes["memory_usage"] = nodes.apply(self.calculate_memory_usage, axis=1)
+        nodes["memory_usage"] = self.calculate_memory_usage(nodes)
     
         # We calculate the cpu_seconds memory (MB) and wattage used per second for each node ... 
     
         nodes = nodes.groupby(DataAnalysis.run_vars + ['run_time', 'instance'])[
             ["cpu_usage", "memory_usage", "wattage_kepler", "wattage_scaph"]].sum()
-        nodes['cost'] = nodes.apply(self.calculate_cost, axis=1)
+        nodes['cost'] = self.calculate_cost(nodes)
     
         pods = self.pods_data.copy()
     
@@ -498,7 +518,7 @@ class DataAnalysis:
         # ... and calculate the runtime overhead by removing the total pod usage from the node usage
         # we assume that the worklaod generator run on a separate node outside of the pod nodes
         runtime_overhead_data = (nodes - pods)
-        runtime_overhead_data['cost'] = runtime_overhead_data.apply(self.calculate_cost, axis=1)
+        runtime_overhead_data['cost'] = self.calculate_cost(runtime_overhead_data)
     
         runtime_overhead_cost = 100 * runtime_overhead_data.groupby(["exp_workload", "exp_branch"])[["cost"]].sum() / \
                                 nodes.groupby(["exp_workload", "exp_branch"])[["cost"]].sum()
@@ -520,7 +540,7 @@ class DataAnalysis:
         pods["type"] = pods["pod_name"].apply(
             lambda x: "pod" if x in self.service_pods else "infra")
         pods = pods[pods["type"] != "infra"]
-        pods["service"] = pods["pod_name"].apply(lambda x: "-".join(x.split("-")[0:2]))
+        pods["service"] = self.service_names(pods["pod_name"])
         pods["service"].unique()
         pods.set_index("run_time")
 
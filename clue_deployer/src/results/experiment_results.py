@@ -1,20 +1,40 @@
-import os
 import pandas as pd # type: ignore
 import numpy as np # type: ignore
-from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 import logging
 from scipy.stats import zscore # type: ignore
+from clue_deployer.src.results.manifest import ResultsManifest
+from clue_deployer.src.results.results_cache import ResultsCache
 
 
 class ExperimentResults:
 
     RUN_VARS = ["exp_start", "exp_branch", "exp_workload", "run_iteration"]
     SCAPH_FACTOR = 100
+    # the frames of the experiment, cached as a whole if the results cache is used
+    FRAMES = ["nodes", "pods", "pod_scaling", "stats", "stats_aggregated", "stats_history", "stats_history_aggregated"]
+    # the run identity and the pod, node and request names, categorical in the compact mode
+    CATEGORICAL_COLUMNS = ["exp_start", "exp_branch", "exp_workload", "run_iteration", "run_start", "run", "urun",
+                           "name", "pod_name", "namespace", "instance", "Name", "Type"]
+    # float32 represents every integer up to 2**24 exactly, larger values (e.g. epoch timestamps) stay float64
+    FLOAT32_LIMIT = 2**24
+    # the metrics aggregated by pods_energy / nodes_energy, weighted by the sample interval
+    POD_WATTAGES = ["wattage_kepler", "wattage_scaph", "cpu_usage", "memory_usage"]
+    NODE_WATTAGES = ["wattage_kepler", "wattage_scaph", "wattage", "cpu_usage", "memory_usage"]
+    # the columns the frames are filtered and grouped by and the derived frames (pod_scaling, *_energy) are computed
+    # from, always loaded with a column projection
+    NODE_REQUIRED_COLUMNS = ["instance", *NODE_WATTAGES, "interval"]
+    POD_REQUIRED_COLUMNS = ["name", "namespace", "instance", *POD_WATTAGES, "interval"]
 
     #Call constructor with iteration folder or with Experiment folder
-    def __init__(self, exp_dir, load_stats_history=True, remove_outliers=True, sut="", ENERGY_WORKLOADS=["exp_scale_fixed", "exp_scale_shaped"]):
+    def __init__(self, exp_dir, load_stats_history=True, remove_outliers=True, sut="", ENERGY_WORKLOADS=["exp_scale_fixed", "exp_scale_shaped"], node_columns=None, pod_columns=None, workers=None, cache=False, compact=False):
         
         self.remove_outliers = remove_outliers
+        # memory efficient frames: categorical run identity and names, float32 metrics and no per row lists
+        self.compact = compact
+        # only load these measurement columns (all by default), parquet measurements are read with column projection
+        self.node_columns = self._with_required(node_columns, self.NODE_REQUIRED_COLUMNS)
+        self.pod_columns = self._with_required(pod_columns, self.POD_REQUIRED_COLUMNS)
 
         # per default, use last experiment performed
         #if not exp_dir:
@@ -23,12 +43,53 @@ class ExperimentResults:
 
         self.exp_dir = exp_dir
         self.sut = sut
-        self.measurement_dirs = glob(self.exp_dir + "/*/*/*/*")
+        # the result files by run and role, from the manifest.json written by the runs or a single scan of exp_dir
+        self.manifest = ResultsManifest.load(self.exp_dir)
 
         self.total_outliers = 0
         self.total_datapoints = 0
         self.ENERGY_WORKLOADS = ENERGY_WORKLOADS
 
+        # the loaded frames by (role, treat, columns), files requested by several loaders are only parsed once
+        self._frames = {}
+        # parse the files of all loaders in a pool of worker processes instead of one after another
+        self.workers = workers
+
+        # the parsed files and frames in exp_dir/.cache, unchanged experiments are not parsed again
+        self.cache = ResultsCache(self.exp_dir) if cache else None
+        cached = False
+        if self.cache is not None:
+            self._cache_key = self.cache.experiment_key(
+                [file["path"] for run in self.manifest.runs for files in run["files"].values() for file in files],
+                [load_stats_history, remove_outliers, self.node_columns, self.pod_columns, ENERGY_WORKLOADS, compact],
+            )
+            cached = self._load_cached_frames()
+        if not cached:
+            self._load_frames(load_stats_history)
+
+        logging.warning(f"loaded {self.total_datapoints} datapoints with {self.total_outliers} outliers{' from the cache' if cached else ''}, {self.memory_usage().sum():.1f} MB in memory")
+
+    @staticmethod
+    def _with_required(columns, required):
+        """The projected columns with the required columns in front, None (all columns) stays None."""
+        if columns is None:
+            return None
+        if isinstance(columns, str):
+            raise ValueError(f"the measurement columns must be a list of column names, not {columns!r}")
+        return list(dict.fromkeys([*required, *columns]))
+
+    def _load_frames(self, load_stats_history):
+        """Parse the result files into the frames of the experiment and cache them."""
+        if self.workers is not None and self.workers > 1:
+            loads = [
+                ("nodes", True, self.node_columns),
+                ("pods", True, self.pod_columns),
+                ("stats", False, None),
+            ]
+            if load_stats_history:
+                loads.append(("stats_history", False, None))
+            self._load_parallel(loads)
+
         self.nodes = self.load_nodes()
         self.pods = self.load_pods() 
         self.pod_scaling = self.load_pod_scaling()
@@ -40,38 +101,76 @@ class ExperimentResults:
             self.stats_history_aggregated = self.load_stat_history(aggregated=True)
         else:
             self.stats_history = pd.DataFrame([],columns=['timestamp', 'user_count', 'type', 'url', 'rq_s', 'frq_s','rq', 'frq', 'mean_rsp_time', 'mean_resp_size', 'exp_workload','exp_branch', 'exp_start', 'run_start', 'run_iteration', 'run','run_time','urun'])
-
-        logging.warn(f"loaded {self.total_datapoints} datapoints with {self.total_outliers} outliers")
+            self.stats_history_aggregated = self.stats_history
+        self._frames.clear()
+        if self.cache is not None:
+            meta = {"datapoints": self.total_datapoints, "outliers": self.total_outliers}
+            for name in self.FRAMES:
+                self.cache.put_frame(name, self._cache_key, getattr(self, name), meta)
+            self.cache.save()
+
+    def _load_cached_frames(self):
+        """Set the frames of the experiment from the cache, False if any of them is missing or outdated."""
+        frames = {}
+        for name in self.FRAMES:
+            cached = self.cache.get_frame(name, self._cache_key)
+            if cached is None:
+                return False
+            frames[name], meta = cached
+        for name, frame in frames.items():
+            setattr(self, name, frame)
+        if "name_prefix" in self.pods:
+            # parquet returns the name prefix lists as arrays
+            self.pods["name_prefix"] = self.pods["name_prefix"].map(list)
+        self.total_datapoints = meta["datapoints"]
+        self.total_outliers = meta["outliers"]
+        return True
+
+    def cached(self, name, compute):
+        """A frame derived from the experiment (e.g. pods_energy), computed once while the result files do not change."""
+        if self.cache is None:
+            return compute()
+        cached = self.cache.get_frame(name, self._cache_key)
+        if cached is not None:
+            return cached[0]
+        frame = compute()
+        self.cache.put_frame(name, self._cache_key, frame)
+        self.cache.save()
+        return frame
 
     def load_pods(self, filter=True):
-        pods = self.get_df_for_prefix("measurements_pod_")
+        pods = self.get_df_for_role("pods", columns=self.pod_columns)
         if filter:
             pods = pods[~pods.name.isin(['loadgenerator'])]
             pods = pods[~pods.instance.isin(['unknown'])]
-            pods['name_prefix'] = pods['name'].apply(lambda n: n.split("-")[:-1])
+            if not self.compact:
+                # the rows of a pod share the list of its name parts
+                pods['name_prefix'] = map_names(pods['name'], lambda names: names.str.split("-").str[:-1])
         return pods 
     
     def load_pod_scaling(self):
         p = self.pods
-        p['pod_name'] = p['name'].apply(lambda x: x[:-2])
+        p['pod_name'] = map_names(p['name'], lambda names: names.str[:-2])
+        if self.compact:
+            p['pod_name'] = p['pod_name'].astype("category")
         pod_scaling = p \
-            .groupby(['exp_branch', 'exp_workload', 'pod_name', 'run_iteration', 'run_time']) \
+            .groupby(['exp_branch', 'exp_workload', 'pod_name', 'run_iteration', 'run_time'], observed=True) \
             .agg({"wattage_scaph": "mean", "wattage_kepler": "mean", "cpu_usage": "sum", 'name': 'nunique'})
         return pod_scaling
 
     def load_nodes(self, estimate=False):
-        nodes = self.get_df_for_prefix("measurements_node_")
+        nodes = self.get_df_for_role("nodes", columns=self.node_columns)
         if estimate:
             NodeEnergyModel.apply(nodes)
             assert "wattage_estimation" in nodes.columns
         return nodes
 
     def load_stats(self):
-        stats = self.get_df_for_prefix(f"{self.sut}_stats.csv", treat=False)
+        stats = self.get_df_for_role("stats", treat=False)
         return stats[stats["Name"] != "Aggregated"]
     
     def load_stats_aggregated(self):
-        stats = self.get_df_for_prefix(f"{self.sut}_stats.csv", treat=False)
+        stats = self.get_df_for_role("stats", treat=False)
         return stats[stats["Name"] == "Aggregated"]
 
     def load_stat_history(self, aggregated=False):
@@ -94,7 +193,7 @@ class ExperimentResults:
             "99.9%":"p999",
         }
 
-        hraw = self.get_df_for_prefix(f"{self.sut}_stats_history.csv", treat=False)
+        hraw = self.get_df_for_role("stats_history", treat=False)
         hraw['is_agg'] = hraw["Name"] == "Aggregated"
         history = hraw[hraw['is_agg'] == aggregated][[*history_cols.keys(), *self.RUN_VARS, "run_start", "run", "urun"]]
         history = history.rename(columns=history_cols)
@@ -103,7 +202,7 @@ class ExperimentResults:
         
         # fixing history
         # Step 1: Calculate the minimum timestamp for each 'urun'
-        min_timestamps = history.groupby("urun")["timestamp"].transform("min")
+        min_timestamps = history.groupby("urun", observed=True)["timestamp"].transform("min")
 
         # Step 2: Subtract the minimum timestamp from each timestamp
         history["run_time"] = history["timestamp"] - min_timestamps
@@ -143,6 +242,8 @@ class ExperimentResults:
                 df[f"{key}_zscore"] = zscore(df[key])
 
         for key in common_keys:
+            if f"{key}_zscore" not in df:
+                continue
             outliers = df[df[f"{key}_zscore"].abs() > z_score_threshold].index
             data_errors += len(outliers)
             df = df.drop(outliers)
@@ -158,18 +259,30 @@ class ExperimentResults:
         # print(f"dropped {data_errors} outliers")
         return data_errors
 
-    def measurement_file_to_df(self, file: str, prefix: str, treat=True):
-        # Windows machines
-        if "\\" in file:
-            file = file.replace("\\", "/")
-        path_components = file.split("/")
-        # Take the last 5 components
-        pr_time, pr_scale, pr_branch, pr_run, pr_name = path_components[-5:]
-        pod_df = pd.read_csv(file)
+    def _read_measurements(self, file: str, columns=None):
+        """Read a measurement file, csv or parquet. Parquet files only read the requested columns from disk."""
+        if file.endswith(".parquet"):
+            if columns is not None:
+                import pyarrow.parquet as pq # type: ignore
+                # older files may miss some of the requested columns
+                available = set(pq.read_schema(file).names)
+                columns = [c for c in columns if c in available]
+            return pd.read_parquet(file, columns=columns)
+        if columns is not None:
+            return pd.read_csv(file, usecols=lambda c: c in columns)
+        return pd.read_csv(file)
+
+    def measurement_file_to_df(self, file: str, run: dict, run_start: str, treat=True, columns=None):
+        """Read a result file of a run of the manifest and add the run variables."""
+        pr_time, pr_scale, pr_branch, pr_run = run["timestamp"], run["workload"], run["variant"], run["iteration"]
+        if columns is not None and treat:
+            # the experiment time is derived from the collection time
+            columns = list(dict.fromkeys([*columns, "collection_time"]))
+        pod_df = self._read_measurements(file, columns)
         pod_df["exp_workload"] = pr_scale
         pod_df["exp_branch"] = pr_branch
         pod_df["exp_start"] = pr_time
-        pod_df["run_start"] = pr_name.replace(prefix, "").replace(".csv", "")
+        pod_df["run_start"] = run_start
         pod_df["run_iteration"] = pr_run
 
         pod_df["run"] = "_".join([pr_branch, pr_scale, pr_run])
@@ -178,20 +291,115 @@ class ExperimentResults:
             if self.remove_outliers:
                 self.total_outliers += self._drop_outliers(pod_df)
             self._set_experiment_time(pod_df)
+        if self.compact:
+            self._compact(pod_df)
 
         return pod_df
 
-    def get_df_for_prefix(self, prefix, treat=True):
-        # Filter measurement_dirs for files starting with prefix
-        pod_files = [d for d in self.measurement_dirs if os.path.basename(d).startswith(prefix)]
-        
+    def _compact(self, df):
+        """Make the identity and name columns categorical and downcast the float64 columns that fit into float32."""
+        for col in self.CATEGORICAL_COLUMNS:
+            if col in df and not isinstance(df[col].dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(df[col]):
+                df[col] = df[col].astype("category")
+        for col in df.columns[df.dtypes == np.float64]:
+            values = df[col].to_numpy()
+            if np.nanmax(np.abs(values), initial=0) < self.FLOAT32_LIMIT:
+                df[col] = values.astype(np.float32)
+
+    def _concat(self, frames):
+        """Concatenate the frames of several files, categorical columns stay categorical over the union of the categories."""
+        if self.compact:
+            for col in self.CATEGORICAL_COLUMNS:
+                dtypes = [f[col].dtype for f in frames if col in f]
+                if len(dtypes) != len(frames) or not all(isinstance(d, pd.CategoricalDtype) for d in dtypes):
+                    continue
+                categories = pd.api.types.union_categoricals([f[col] for f in frames]).categories
+                for f in frames:
+                    f[col] = f[col].cat.set_categories(categories)
+        return pd.concat(frames)
+
+    def memory_usage(self) -> pd.Series:
+        """MB in memory of every loaded frame of the experiment."""
+        return pd.Series({
+            name: getattr(self, name).memory_usage(deep=True).sum() / 2**20 for name in self.FRAMES if hasattr(self, name)
+        })
+
+    def _cached_file(self, file, treat, columns):
+        """The parsed frame of a file from the cache, None if it was not parsed yet or changed since."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get_file(file["path"], [treat, columns, self.remove_outliers, self.compact])
+        if cached is None:
+            return None
+        df, meta = cached
+        self.total_datapoints += meta["datapoints"]
+        self.total_outliers += meta["outliers"]
+        return df
+
+    def _cache_file(self, file, treat, columns, df, datapoints, outliers):
+        if self.cache is not None:
+            self.cache.put_file(file["path"], [treat, columns, self.remove_outliers, self.compact], df, {"datapoints": datapoints, "outliers": outliers})
+
+    def _read_file(self, run, file, treat, columns):
+        df = self._cached_file(file, treat, columns)
+        if df is None:
+            datapoints, outliers = self.total_datapoints, self.total_outliers
+            df = self.measurement_file_to_df(self.manifest.path(file), run, file["run_start"], treat, columns)
+            self._cache_file(file, treat, columns, df, self.total_datapoints - datapoints, self.total_outliers - outliers)
+        return df
+
+    def _load_parallel(self, loads):
+        """
+        Parse the files of all (role, treat, columns) loads concurrently in worker processes
+        and concatenate the frames of every load once.
+        """
+        files = {load: self.manifest.files(load[0]) for load in loads}
+        # only the files that are not cached are parsed
+        cached = {(load, i): self._cached_file(files[load][i][1], load[1], load[2]) for load in loads for i in range(len(files[load]))}
+        tasks = [task for task, df in cached.items() if df is None]
+        # the largest files first, so that no large file is started last
+        tasks.sort(key=lambda task: files[task[0]][task[1]][1]["size"], reverse=True)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            for load, i in tasks:
+                run, file = files[load][i]
+                futures[(load, i)] = pool.submit(
+                    _parse_measurement_file, self.remove_outliers, self.compact, self.manifest.path(file), run, file["run_start"], load[1], load[2]
+                )
+            for load in loads:
+                frames = []
+                # concatenated in the order of the serial loading
+                for i in range(len(files[load])):
+                    if cached[(load, i)] is not None:
+                        frames.append(cached[(load, i)])
+                        continue
+                    df, datapoints, outliers = futures[(load, i)].result()
+                    self.total_datapoints += datapoints
+                    self.total_outliers += outliers
+                    self._cache_file(files[load][i][1], load[1], load[2], df, datapoints, outliers)
+                    frames.append(df)
+                if not frames:
+                    print(f"No {load[0]} files in the manifest of {self.exp_dir}")
+                self._frames[self._frame_key(*load)] = self._concat(frames) if frames else pd.DataFrame()
+
+    def _frame_key(self, role, treat, columns):
+        return (role, treat, tuple(columns) if columns is not None else None)
+
+    def get_df_for_role(self, role, treat=True, columns=None):
+        """All files of a role (nodes, pods, stats, stats_history, ...) of the manifest in one frame."""
+        key = self._frame_key(role, treat, columns)
+        if key in self._frames:
+            return self._frames[key]
+
+        pod_files = self.manifest.files(role)
         if not pod_files:
-            print(f"No files found with prefix '{prefix}' in measurement_dirs")
+            print(f"No {role} files in the manifest of {self.exp_dir}")
             return pd.DataFrame()  # Return empty DataFrame if no files match
         
-        all_pods = pd.concat(
-            [self.measurement_file_to_df(pf, prefix, treat) for pf in pod_files]
+        all_pods = self._concat(
+            [self._read_file(run, pf, treat, columns) for run, pf in pod_files]
         )
+        self._frames[key] = all_pods
         return all_pods
 
     def absolute_requests_per_branch(self) -> pd.DataFrame:
@@ -209,7 +417,7 @@ class ExperimentResults:
         # requests.groupby(["exp_branch","exp_workload"])[["real_requests","request_per_s"]].sum()
 
         runs = (
-            self.stats.groupby(ExperimentResults.RUN_VARS)[
+            self.stats.groupby(ExperimentResults.RUN_VARS, observed=True)[
                 ["Request Count", "Failure Count"]
             ]
             .sum()
@@ -223,7 +431,7 @@ class ExperimentResults:
         # return reliability
 
         exp_runtime = (
-            self.pods.groupby(ExperimentResults.RUN_VARS)["run_time"]
+            self.pods.groupby(ExperimentResults.RUN_VARS, observed=True)["run_time"]
             .max()
             .reset_index()
         )
@@ -263,11 +471,24 @@ class ExperimentResults:
 
         raw["wattage_scaph"] *= self.SCAPH_FACTOR
 
-        wsum = raw.groupby(self.RUN_VARS).agg(
+        if "interval" in raw and raw["interval"].notna().all() and raw["interval"].nunique() > 1:
+            # samples of the adaptive tracker cover different time spans, the averages weight every sample with its interval.
+            # The wattage columns stay the plain sums of the samples, comparable with runs at a fixed interval
+            weighted = {f"{w}_weighted": raw[w] * raw["interval"] for w in wattages}
+            raw = raw.assign(**weighted)
+            wsum = raw.groupby(self.RUN_VARS, observed=True).agg(
+                {"run_time": "max", "interval": "sum"} | {w: "sum" for w in wattages} | {w: "sum" for w in weighted}
+            )
+            for w in wattages:
+                # time weighted mean over the run time
+                wsum[f"{w}_avg"] = wsum[f"{w}_weighted"] / wsum["interval"] * wsum["run_time"].dt.total_seconds()
+            return wsum.drop(columns=["interval", *weighted])
+
+        wsum = raw.groupby(self.RUN_VARS, observed=True).agg(
             {"run_time": "max"} | {w: "sum" for w in wattages}
         )
 
-        wavg = raw.groupby(self.RUN_VARS).agg(
+        wavg = raw.groupby(self.RUN_VARS, observed=True).agg(
             {"run_time": "max"} | {w: "mean" for w in wattages}
         )
 
@@ -277,18 +498,15 @@ class ExperimentResults:
         return wsum
 
     def pods_energy(self, energy_workloads=True):
-        wattages = ["wattage_kepler", "wattage_scaph", "cpu_usage", "memory_usage"]
-        return self._calc_energy(self.pods, wattages, energy_workloads)
+        return self._calc_energy(self.pods, self.POD_WATTAGES, energy_workloads)
     
     def auth_pod_energy(self, energy_workloads=False):
         auth_pods = self.pods[self.pods.name.str.contains("auth")]
-        wattages = ["wattage_kepler", "wattage_scaph", "cpu_usage", "memory_usage"]
-        return self._calc_energy(auth_pods, wattages, energy_workloads)
+        return self._calc_energy(auth_pods, self.POD_WATTAGES, energy_workloads)
 
 
     def nodes_energy(self):
-        wattages = ["wattage_kepler", "wattage_scaph", "wattage", "cpu_usage", "memory_usage"]
-        return self._calc_energy(self.nodes, wattages)
+        return self._calc_energy(self.nodes, self.NODE_WATTAGES)
 
     def rps_per_branch(self) -> pd.DataFrame:
         stats = self.run_stats()
@@ -299,6 +517,30 @@ class ExperimentResults:
         return m
 
 
+def map_names(names: pd.Series, transform) -> pd.Series:
+    """
+    Apply transform, a vectorized function of a Series, once per distinct value of names and map the results back to the rows.
+    Pod, node and request names repeat in every sample, so only a few hundred values are transformed instead of every row.
+    """
+    codes, uniques = pd.factorize(names, use_na_sentinel=False)
+    values = transform(pd.Series(np.asarray(uniques, dtype=object)).infer_objects())
+    return values.take(codes).set_axis(names.index).rename(names.name)
+
+
+def _parse_measurement_file(remove_outliers, compact, file, run, run_start, treat, columns):
+    """
+    Parse a single file in a worker process of the parallel loading.
+    Returns the frame and the number of data points and outliers counted while parsing it.
+    """
+    loader = ExperimentResults.__new__(ExperimentResults)
+    loader.remove_outliers = remove_outliers
+    loader.compact = compact
+    loader.total_datapoints = 0
+    loader.total_outliers = 0
+    df = loader.measurement_file_to_df(file, run, run_start, treat, columns)
+    return df, loader.total_datapoints, loader.total_outliers
+
+
 class NodeEnergyModel:
     physical_nodes = ["sm-gpu", "ise-knode6"]
     cpu_specs = {
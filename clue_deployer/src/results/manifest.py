@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# role -> (file name prefix, file name suffixes), the locust files are prefixed with the name of the SUT
+MEASUREMENT_ROLES = {
+    "nodes": ("measurements_node_", (".csv", ".parquet")),
+    "pods": ("measurements_pod_", (".csv", ".parquet")),
+}
+LOCUST_ROLES = {
+    "stats_history": "_stats_history.csv",
+    "stats": "_stats.csv",
+    "failures": "_failures.csv",
+    "exceptions": "_exceptions.csv",
+}
+
+
+def file_role(name: str):
+    """The role of a result file by its name, None for files the results are not loaded from (logs, values, ...)."""
+    for role, (prefix, suffixes) in MEASUREMENT_ROLES.items():
+        if name.startswith(prefix) and name.endswith(suffixes):
+            return role
+    for role, suffix in LOCUST_ROLES.items():
+        if name.endswith(suffix):
+            return role
+    return None
+
+
+def run_start(name: str, role: str) -> str:
+    """The start of the run in the name of a measurement file, empty for the locust files."""
+    if role not in MEASUREMENT_ROLES:
+        return ""
+    prefix, suffixes = MEASUREMENT_ROLES[role]
+    stem = name[len(prefix):]
+    for suffix in suffixes:
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+
+
+class ResultsManifest:
+    """
+    The result files of an experiment (data/<sut>/<timestamp>) by run and role.
+
+    Every run (timestamp, workload, variant, iteration) lists its files by role, with the path relative to the
+    experiment folder, the size and the run start of the measurement files. The manifest is written to
+    manifest.json next to experiment.json after every run. It lists every run folder of the experiment, including
+    runs that failed or were interrupted with the files they left. A manifest that lists files which were deleted
+    or renamed since is replaced by a scan when it is loaded.
+    """
+
+    def __init__(self, exp_dir, runs: list):
+        self.exp_dir = exp_dir
+        self.runs = runs
+
+    @classmethod
+    def scan(cls, exp_dir):
+        """Build the manifest with a single scan of the experiment folder."""
+        timestamp = os.path.basename(os.path.normpath(exp_dir))
+        runs = []
+        for workload in _subdirs(exp_dir):
+            for variant in _subdirs(os.path.join(exp_dir, workload)):
+                for iteration in _subdirs(os.path.join(exp_dir, workload, variant)):
+                    files = {}
+                    with os.scandir(os.path.join(exp_dir, workload, variant, iteration)) as entries:
+                        entries = sorted(entries, key=lambda e: e.name)
+                        names = {entry.name for entry in entries}
+                        for entry in entries:
+                            role = file_role(entry.name)
+                            if role is None or not entry.is_file():
+                                continue
+                            if role in MEASUREMENT_ROLES and _spooled(entry.name, names):
+                                continue
+                            files.setdefault(role, []).append({
+                                "path": "/".join([workload, variant, iteration, entry.name]),
+                                "size": entry.stat().st_size,
+                                "run_start": run_start(entry.name, role),
+                            })
+                    runs.append({
+                        "timestamp": timestamp,
+                        "workload": workload,
+                        "variant": variant,
+                        "iteration": iteration,
+                        "files": files,
+                    })
+        return cls(exp_dir, runs)
+
+    @classmethod
+    def load(cls, exp_dir):
+        """Read the manifest.json of the experiment, experiments without one (e.g. older results) are scanned."""
+        manifest_path = os.path.join(exp_dir, MANIFEST_FILE)
+        if not os.path.isfile(manifest_path):
+            return cls.scan(exp_dir)
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return cls.scan(exp_dir)
+        loaded = cls(exp_dir, manifest["runs"])
+        missing = [file["path"] for run in loaded.runs for files in run["files"].values() for file in files
+                   if not os.path.isfile(loaded.path(file))]
+        if missing:
+            logging.warning(f"{len(missing)} files of {manifest_path} are missing (e.g. {missing[0]}), scanning {exp_dir}")
+            return cls.scan(exp_dir)
+        return loaded
+
+    def write(self):
+        """Write manifest.json, replaced at once so that readers never see a partial manifest."""
+        manifest_path = os.path.join(self.exp_dir, MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "runs": self.runs}, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def files(self, role: str):
+        """The (run, file) pairs of a role, in the order of the runs."""
+        return [(run, file) for run in self.runs for file in run["files"].get(role, [])]
+
+    def path(self, file: dict) -> str:
+        return os.path.join(self.exp_dir, file["path"])
+
+
+def _spooled(name: str, names: set) -> bool:
+    """A CSV spool of a Parquet measurement file that was converted, its rows are in the Parquet file."""
+    return name.endswith(".csv") and name[:-len(".csv")] + ".parquet" in names
+
+
+def _subdirs(folder):
+    with os.scandir(folder) as entries:
+        # hidden folders, e.g. the .cache of the parsed results, are not runs
+        return sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith("."))
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import os
+import pandas as pd # type: ignore
+
+CACHE_FOLDER = ".cache"
+INDEX_FILE = "index.json"
+# bump when the parsing of the result files changes, older cache entries are ignored then
+CACHE_VERSION = 2
+
+
+class ResultsCache:
+    """
+    An on-disk cache of the parsed result files of an experiment, in <exp_dir>/.cache as parquet files.
+
+    Every parsed file is cached on its own, keyed by its path and the load options and invalidated when the
+    size or mtime of the file changes, so a changed or added run only re-parses its own files. The frames of
+    the whole experiment (the cleaned frames and derived aggregates) are cached under the fingerprint of all
+    files, reopening an unchanged experiment reads them without parsing anything.
+    """
+
+    def __init__(self, exp_dir, folder=CACHE_FOLDER):
+        self.exp_dir = exp_dir
+        self.cache_dir = os.path.join(exp_dir, folder)
+        self.index = self._read_index()
+        self._dirty = False
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, INDEX_FILE), "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {"version": CACHE_VERSION, "files": {}, "frames": {}}
+        if index.get("version") != CACHE_VERSION:
+            return {"version": CACHE_VERSION, "files": {}, "frames": {}}
+        return index
+
+    def fingerprint(self, path: str):
+        """[size, mtime] of a result file, None if it does not exist (anymore)."""
+        try:
+            stat = os.stat(os.path.join(self.exp_dir, path))
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def experiment_key(self, paths, options) -> str:
+        """The key of the experiment frames, changes with any of the files or the load options."""
+        files = sorted([path, *self.fingerprint(path)] for path in paths)
+        return _digest([files, options])
+
+    def get_file(self, path: str, options):
+        """(frame, meta) of a parsed file, None if it is not cached or the file changed since."""
+        key = _digest([path, options])
+        entry = self.index["files"].get(key)
+        if entry is None or entry["fingerprint"] is None or entry["fingerprint"] != self.fingerprint(path):
+            return None
+        frame = self._read(entry["frame"])
+        return None if frame is None else (frame, entry["meta"])
+
+    def put_file(self, path: str, options, frame: pd.DataFrame, meta=None):
+        key = _digest([path, options])
+        if self._write(f"file-{key}.parquet", frame):
+            self.index["files"][key] = {"path": path, "fingerprint": self.fingerprint(path), "frame": f"file-{key}.parquet", "meta": meta}
+            self._dirty = True
+
+    def get_frame(self, name: str, key: str):
+        """(frame, meta) of an experiment frame cached under key, None if the experiment changed since."""
+        entry = self.index["frames"].get(name)
+        if entry is None or entry["key"] != key:
+            return None
+        frame = self._read(entry["frame"])
+        return None if frame is None else (frame, entry["meta"])
+
+    def put_frame(self, name: str, key: str, frame: pd.DataFrame, meta=None):
+        if self._write(f"frame-{name}.parquet", frame):
+            self.index["frames"][name] = {"key": key, "frame": f"frame-{name}.parquet", "meta": meta}
+            self._dirty = True
+
+    def save(self):
+        """Write the index, replaced at once so that concurrent readers never see a partial index."""
+        if not self._dirty:
+            return
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        try:
+            with open(index_path + ".tmp", "w") as f:
+                json.dump(self.index, f)
+            os.replace(index_path + ".tmp", index_path)
+            self._dirty = False
+        except OSError as e:
+            logging.warning(f"Could not write the results cache index {index_path}: {e}")
+
+    def _read(self, name):
+        try:
+            return pd.read_parquet(os.path.join(self.cache_dir, name))
+        except Exception as e:
+            logging.warning(f"Could not read the cached frame {name}, parsing it again: {e}")
+            return None
+
+    def _write(self, name, frame):
+        # the results folder may be read only, the results are loaded without the cache then
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = os.path.join(self.cache_dir, name)
+            frame.to_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            return True
+        except Exception as e:
+            logging.warning(f"Could not cache the frame {name}: {e}")
+            return False
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:20]
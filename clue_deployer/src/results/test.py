@@ -0,0 +1,93 @@
+from clue_deployer.src.results.experiment_results import ExperimentResults
+from clue_deployer.src.results.manifest import ResultsManifest
+import numpy as np
+import pandas as pd
+import os
+import shutil
+import tempfile
+
+from sys import exit
+
+POD_NAMES = ["teastore-webui-7d9f-x1", "teastore-auth-5c4b-x2", "loadgenerator-1a2b-x3"]
+NODES = ["node-0", "node-1"]
+
+def write_experiment(root, fmt="csv", seconds=60):
+    """A single run of an energy workload with the pod, node and locust files the results are loaded from."""
+    exp_dir = os.path.join(root, "2025-05-11_12-00-00")
+    run_dir = os.path.join(exp_dir, "exp_scale_fixed", "baseline", "0")
+    os.makedirs(run_dir)
+    rng = np.random.default_rng(0)
+    times = np.repeat(pd.date_range("2025-05-11 12:00:00", periods=seconds, freq="s"), len(POD_NAMES))
+    n = len(times)
+    pods = pd.DataFrame({
+        "collection_time": times, "observation_time": times,
+        "name": np.tile(POD_NAMES, seconds), "namespace": "tea-bench",
+        "cpu_usage": rng.random(n), "memory_usage": rng.random(n) * 800, "network_usage": rng.random(n),
+        "instance": np.tile(NODES[:1] + NODES, seconds),
+        "wattage_kepler": rng.random(n) * 10, "wattage_scaph": rng.random(n) * 0.1, "interval": 1.0,
+    })
+    times = np.repeat(pd.date_range("2025-05-11 12:00:00", periods=seconds, freq="s"), len(NODES))
+    n = len(times)
+    nodes = pd.DataFrame({
+        "instance": np.tile(NODES, seconds), "observation_time": times, "collection_time": times,
+        "cpu_usage": rng.random(n) * 8, "memory_usage": rng.random(n), "network_usage": rng.random(n),
+        "wattage": rng.random(n) * 100, "num_processes": 30.0, "wattage_kepler": rng.random(n) * 50,
+        "wattage_scaph": rng.random(n), "wattage_auxilary": rng.random(n), "temperture": 40.0, "interval": 1.0,
+    })
+    for role, frame in [("pod", pods), ("node", nodes)]:
+        path = os.path.join(run_dir, f"measurements_{role}_20250511120000.{fmt}")
+        if fmt == "parquet":
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+    with open(os.path.join(run_dir, "teastore_stats.csv"), "w") as f:
+        f.write("Type,Name,Request Count,Failure Count,Median Response Time,Average Response Time,Min Response Time,Max Response Time,Average Content Size,Requests/s,Failures/s,50%,66%,75%,80%,90%,95%,98%,99%,99.9%,99.99%,100%\n")
+        for name in ["/tools.descartes.teastore.webui/", "Aggregated"]:
+            f.write(f"GET,{name},1000,10,40,42.1,3,400,2048.0,1.2,0.0" + ",40" * 11 + "\n")
+    return exp_dir
+
+def test_narrow_projection(fmt="csv"):
+    """A projection of a single metric still loads every frame, the derived frames match the full load."""
+    root = tempfile.mkdtemp(prefix="clue-results-")
+    try:
+        exp_dir = write_experiment(root, fmt)
+        full = ExperimentResults(exp_dir, load_stats_history=False, remove_outliers=False)
+        narrow = ExperimentResults(exp_dir, load_stats_history=False, remove_outliers=False, pod_columns=["cpu_usage"], node_columns=["cpu_usage"])
+
+        assert "network_usage" not in narrow.pods and "observation_time" not in narrow.pods, list(narrow.pods.columns)
+        assert "temperture" not in narrow.nodes and "num_processes" not in narrow.nodes, list(narrow.nodes.columns)
+        pd.testing.assert_frame_equal(narrow.pod_scaling, full.pod_scaling)
+        pd.testing.assert_frame_equal(narrow.pods_energy(), full.pods_energy())
+        pd.testing.assert_frame_equal(narrow.nodes_energy(), full.nodes_energy())
+        pd.testing.assert_frame_equal(narrow.run_stats(), full.run_stats())
+        try:
+            ExperimentResults(exp_dir, load_stats_history=False, pod_columns="cpu_usage")
+            raise AssertionError("a single column name is not a projection")
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(root)
+    print(f"narrow {fmt} projection:\t ok")
+
+def test_stale_manifest():
+    """A manifest that lists a renamed file is replaced by a scan, the cached experiment is parsed again."""
+    root = tempfile.mkdtemp(prefix="clue-results-")
+    try:
+        exp_dir = write_experiment(root)
+        ResultsManifest.scan(exp_dir).write()
+        loaded = ExperimentResults(exp_dir, load_stats_history=False, cache=True)
+        run_dir = os.path.join(exp_dir, "exp_scale_fixed", "baseline", "0")
+        os.rename(os.path.join(run_dir, "measurements_node_20250511120000.csv"), os.path.join(run_dir, "measurements_node_20250511120500.csv"))
+
+        reloaded = ExperimentResults(exp_dir, load_stats_history=False, cache=True)
+        assert len(reloaded.nodes) == len(loaded.nodes), (len(reloaded.nodes), len(loaded.nodes))
+        assert set(reloaded.nodes["run_start"]) == {"20250511120500"}, set(reloaded.nodes["run_start"])
+    finally:
+        shutil.rmtree(root)
+    print("stale manifest:\t ok")
+
+if __name__ == '__main__':
+    test_narrow_projection("csv")
+    test_narrow_projection("parquet")
+    test_stale_manifest()
+    exit(0)
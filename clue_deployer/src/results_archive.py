@@ -0,0 +1,91 @@
+import base64
+import io
+import tarfile
+from clue_deployer.src.logger import process_logger as logger
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Base64StreamDecoder:
+    """
+    Decodes base64 that arrives in chunks of arbitrary size, e.g. a streamed pod log.
+    Whitespace is dropped and incomplete 4 character groups are kept until the next chunk.
+    """
+
+    def __init__(self):
+        self._rest = b""
+
+    def decode(self, chunk: bytes) -> bytes:
+        data = self._rest + chunk.translate(None, b" \t\r\n")
+        end = len(data) - len(data) % 4
+        self._rest = data[end:]
+        return base64.b64decode(data[:end])
+
+    def finish(self):
+        """Check that the stream ended on a complete group."""
+        if self._rest:
+            logger.warning(f"{len(self._rest)} trailing base64 characters in the results stream, the archive may be truncated")
+        self._rest = b""
+
+
+class ArchiveStream(io.RawIOBase):
+    """
+    Read-only file view of a base64 encoded archive that arrives in chunks, the chunks are decoded on demand.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = Base64StreamDecoder()
+        self._buffer = b""
+        self._offset = 0
+        self._done = False
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def _fill(self, n: int):
+        """Decode chunks until n bytes are buffered or the stream ended."""
+        while len(self._buffer) - self._offset < n and not self._done:
+            try:
+                decoded = self._decoder.decode(next(self._chunks))
+            except StopIteration:
+                self._decoder.finish()
+                self._done = True
+                break
+            self._buffer = self._buffer[self._offset:] + decoded
+            self._offset = 0
+            self.size += len(decoded)
+
+    def peek(self, n: int) -> bytes:
+        self._fill(n)
+        return self._buffer[self._offset:self._offset + n]
+
+    def readinto(self, b):
+        self._fill(1)
+        n = min(len(b), len(self._buffer) - self._offset)
+        b[:n] = self._buffer[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+
+def extract_archive(stream: ArchiveStream, path: str):
+    """
+    Extract a gzip or zstd compressed tar stream to path while it is still arriving, the codec is detected from the magic bytes.
+    Returns the detected codec.
+    """
+    magic = stream.peek(4)
+    if magic.startswith(GZIP_MAGIC):
+        codec = "gzip"
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            tar.extractall(path=path)
+    elif magic.startswith(ZSTD_MAGIC):
+        import zstandard
+        codec = "zstd"
+        with zstandard.ZstdDecompressor().stream_reader(stream) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                tar.extractall(path=path)
+    else:
+        raise tarfile.TarError(f"unknown archive format (magic bytes {magic.hex()})")
+    return codec
@@ -78,7 +78,9 @@ class ServerManager:
                 config_file_path=f"/app/sut_configs/{sut_name}.yaml",
                 sut_name=sut_name,
                 load_from_hdf5=load_from_hdf5,
-                hdf5_path=hdf5_path
+                hdf5_path=hdf5_path,
+                load_workers=CONFIGS.clue_config.results_load_workers,
+                cache=CONFIGS.clue_config.results_cache
             )
             da.create_server()
             
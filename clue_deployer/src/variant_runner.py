@@ -3,6 +3,7 @@ import threading
 
 from datetime import datetime
 from clue_deployer.src.agent.psc.tracker import NodeUsage, PodUsage, ResourceTracker
+from clue_deployer.src.agent.psc.adaptive_interval import AdaptiveInterval
 from clue_deployer.src.configs.configs import CONFIGS
 from clue_deployer.src.models.variant import Variant
 from clue_deployer.src.models.workload import Workload
@@ -25,6 +26,11 @@ class VariantRunner:
         self._tracker = None
         self._node_channel = None
         self._pod_channel = None
+        self._backfill = CONFIGS.clue_config.tracker_backfill
+        self._workload_start = None
+        self._workload_end = None
+        self._backfilled = False
+        self._adaptive_interval = None
 
     def _cancel_handler(self, sig=None, frame=None):
         """Handler for timeout, SIGINT, or manual cancellation."""
@@ -35,11 +41,11 @@ class VariantRunner:
         logger.warning(f"Workload timeout of {self.workload.timeout_duration}s reached, stopping the experiment.")
         
         if self._tracker:
-            self._tracker.stop()
+            self._stop_tracking()
         if self._pod_channel:
-            self._pod_channel.flush()
+            self._pod_channel.close()
         if self._node_channel:
-            self._node_channel.flush()
+            self._node_channel.close()
             
         if platform.system() != "Windows":
             signal.raise_signal(signal.SIGUSR1)  # raise SIGUSR1 on Unix-like systems
@@ -49,6 +55,35 @@ class VariantRunner:
         StatusManager.set(StatusPhase.DONE, " workload timeout reached, Done :)")
         raise SystemExit(0)  # Exit gracefully
 
+    def _stop_tracking(self):
+        """Stop the live tracker or, in backfill mode, collect the samples of the workload window."""
+        if not self._backfill:
+            self._tracker.stop()
+            return
+        if self._workload_start is None:
+            logger.warning("Workload did not start, nothing to backfill")
+            return
+        if self._backfilled:
+            return
+        self._backfilled = True
+        if self._workload_end is None:
+            self._workload_end = datetime.now()
+        try:
+            logger.info(f"Backfilling resource metrics from {self._workload_start} to {self._workload_end}")
+            self._tracker.backfill(self._workload_start, self._workload_end)
+        except Exception as e:
+            logger.error(f"Failed to backfill resource metrics: {e}")
+        finally:
+            # release the pod watch and query pool of the tracker
+            self._tracker.stop()
+
+    def _announce_load_transitions(self, start: datetime):
+        """
+        Announce the phases of the load shape to the adaptive sampler, relative to the workload start.
+        The workload generator starts a bit later than the workload runner, deviations are caught by the load deltas.
+        """
+        self._adaptive_interval.announce_load_shape(start.timestamp(), self.workload.workload_settings, self.workload.workload_runtime)
+
     def _setup_signal_handlers(self):
         """Set up signal handlers for cancellation."""
         # Set up SIGINT handler (Ctrl+C) for all platforms
@@ -81,24 +116,36 @@ class VariantRunner:
 
     def run(self, results_path: str):
         # TODO: autoscaling is set up upon branch deployment but cleaned up here
+        output_format = CONFIGS.clue_config.tracker_output_format
         node_file = path.join(
-            results_path, f"measurements_node_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.csv"
+            results_path, f"measurements_node_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.{output_format}"
         )
 
         # noinspection PyProtectedMember
         self._node_channel = FlushingQueue(
-            node_file, buffer_size=32, fields=NodeUsage._fields
+            node_file, buffer_size=32, fields=NodeUsage._fields,
+            background=CONFIGS.clue_config.tracker_background_writer, fsync=CONFIGS.clue_config.tracker_fsync,
+            output_format=output_format, types=NodeUsage._types,
         )
 
         pod_file = path.join(
-            results_path, f"measurements_pod_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.csv"
+            results_path, f"measurements_pod_{datetime.now().strftime('%d_%m_%Y_%H_%M')}.{output_format}"
         )
 
         # noinspection PyProtectedMember
         self._pod_channel = FlushingQueue(
-            pod_file, buffer_size=32, fields=PodUsage._fields
+            pod_file, buffer_size=32, fields=PodUsage._fields,
+            background=CONFIGS.clue_config.tracker_background_writer, fsync=CONFIGS.clue_config.tracker_fsync,
+            output_format=output_format, types=PodUsage._types,
         )
 
+        if CONFIGS.clue_config.tracker_adaptive_interval:
+            self._adaptive_interval = AdaptiveInterval(
+                min_interval=CONFIGS.clue_config.tracker_min_interval,
+                max_interval=CONFIGS.clue_config.tracker_max_interval,
+                threshold=CONFIGS.clue_config.tracker_change_threshold,
+            )
+
         # tracker = ResourceTracker(exp.prometheus, observations_channel, tracker_namespaces, 10)
         self._tracker = ResourceTracker(
             prometheus_url=CONFIGS.clue_config.prometheus_url,
@@ -106,15 +153,26 @@ class VariantRunner:
             pod_channel=self._pod_channel,
             namespaces=[CONFIGS.sut_config.namespace] + CONFIGS.sut_config.infrastructure_namespaces,
             interval=10,
+            concurrent_queries=CONFIGS.clue_config.tracker_concurrent_queries,
+            max_workers=CONFIGS.clue_config.tracker_max_workers,
+            batch_namespaces=CONFIGS.clue_config.tracker_batch_namespaces,
+            watch_pods=CONFIGS.clue_config.tracker_watch_pods,
+            node_map_ttl=CONFIGS.clue_config.tracker_node_map_ttl,
+            vectorized=CONFIGS.clue_config.tracker_vectorized,
+            filter_scaphandre=CONFIGS.clue_config.tracker_filter_scaphandre,
+            metrics=CONFIGS.clue_config.tracker_metrics,
+            recording_rules=CONFIGS.clue_config.tracker_recording_rules,
+            adaptive_interval=self._adaptive_interval,
         )
         
         # Create a variant info
         with open(path.join(results_path, "variant_info.json"), "w") as f:
             f.write(self.variant.create_json())
         
-        # Start resource tracker
-        logger.info("Starting resource tracker")
-        self._tracker.start()
+        # Start resource tracker, in backfill mode the metrics are collected after the workload
+        if not self._backfill:
+            logger.info("Starting resource tracker")
+            self._tracker.start()
 
         # Set up signal handlers
         self._setup_signal_handlers()
@@ -130,18 +188,22 @@ class VariantRunner:
             workload_runner = WorkloadRunner(self.variant, self.workload)
             
             # Will run remotely or locally based on experiment
+            self._workload_start = datetime.now()
+            if self._adaptive_interval is not None:
+                self._announce_load_transitions(self._workload_start)
             try:
                 workload_runner.run_workload(results_path)
             except WorkloadCancelled as e:
                 logger.warning("Workload was cancelled due to exception: " + str(e))
+            self._workload_end = datetime.now()
                 
             StatusManager.set(StatusPhase.DONE, " Experiment Done, flushing channels :)")
             logger.info("Finished running workload, stopping trackers and flushing channels")
             
             # stop resource tracker
-            self._tracker.stop()
-            self._node_channel.flush()
-            self._pod_channel.flush()
+            self._stop_tracking()
+            self._node_channel.close()
+            self._pod_channel.close()
             
         except SystemExit:
             _ = None  # Ignore SystemExit raised by the cancel function and clean up gracefully
@@ -1,11 +1,9 @@
-import base64
 import os
 import platform
 import signal
 import subprocess
 import tarfile
 from os import path
-from tempfile import TemporaryFile
 import docker
 import logging
 from kubernetes import client, watch
@@ -16,10 +14,14 @@ from clue_deployer.src.models.result_files import ResultFiles
 from clue_deployer.src.models.workload import Workload
 from clue_deployer.src.models.workload_cancelled_exception import WorkloadCancelled
 from clue_deployer.src.logger import process_logger as logger
+from clue_deployer.src.results_archive import ArchiveStream, extract_archive
 
 
 class WorkloadRunner:
 
+    # bytes read from the log stream at once
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
     def __init__(self, variant: Variant, workload: Workload):
         self.variant = variant
         self.workload = workload
@@ -180,6 +182,14 @@ class WorkloadRunner:
             )
         )
 
+        # The compression of the results archive
+        container_env.append(
+            client.V1EnvVar(
+                name="RESULTS_CODEC",
+                value= CONFIGS.clue_config.results_codec
+            )
+        )
+
         locust_volumes = []
         locust_volume_mounts = []
         locust_file_paths_in_container = []
@@ -303,28 +313,23 @@ class WorkloadRunner:
         """
         try:
             core = client.CoreV1Api()
-            resp = core.read_namespaced_pod_log(name=pod_name, namespace=CONFIGS.sut_config.namespace)
-            log_contents = resp
-            if not log_contents or len(log_contents) == 0:
-                logger.error(f"{pod_name} in namespace {CONFIGS.sut_config.namespace} has no logs, workload failed?")
-                return 
-            
-            with TemporaryFile() as tar_buffer:
-                tar_buffer.write(base64.b64decode(log_contents))
-                tar_buffer.seek(0)
-
-                with tarfile.open(
-                        fileobj=tar_buffer,
-                        mode="r:gz",
-                ) as tar:
-                    tar.extractall(path=results_path)
-            logger.info(f"Succesfully downloaded results from pod {pod_name} in namespace {CONFIGS.sut_config.namespace} to {results_path}!")
+            # stream the base64 encoded archive from the log, files are extracted while the download is running
+            resp = core.read_namespaced_pod_log(name=pod_name, namespace=CONFIGS.sut_config.namespace, _preload_content=False)
+            try:
+                stream = ArchiveStream(resp.stream(self.DOWNLOAD_CHUNK_SIZE))
+                if not stream.peek(1):
+                    logger.error(f"{pod_name} in namespace {CONFIGS.sut_config.namespace} has no logs, workload failed?")
+                    return
+                codec = extract_archive(stream, results_path)
+            finally:
+                resp.release_conn()
+            logger.info(f"Succesfully downloaded results ({stream.size} bytes {codec}) from pod {pod_name} in namespace {CONFIGS.sut_config.namespace} to {results_path}!")
         except ApiException as e:
             logger.error(f"failed to get log from pod {pod_name} in namespace {CONFIGS.sut_config.namespace}: %s", e)
         except tarfile.TarError as e:
-            logger.error(f"failed to extract log from TAR", e, log_contents)
+            logger.error(f"failed to extract the results archive of pod {pod_name}: {e}")
         except Exception as e:
-            logger.error("failed to extraxt log",e,log_contents)
+            logger.error(f"failed to download the results of pod {pod_name}: {e}")
             
 
     def _run_local_workload(self, outpath):
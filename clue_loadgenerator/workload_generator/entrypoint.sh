@@ -39,6 +39,16 @@ locust $LOCUST_FILE_ARGS --csv $SUT_NAME --csv-full-history --headless --only-su
 
 SANITIZED_SUT_NAME=$(echo "$SUT_NAME" | sed 's/-/_/g')
 
+# Tar, compress and base64 encode the given files to stdout, so they can get pulled by the deployer from the log.
+# RESULTS_CODEC selects the compression: gzip (default) or zstd, the deployer detects the codec from the archive.
+archive_results() {
+  if [ "$RESULTS_CODEC" = "zstd" ]; then
+    tar cf - "$@" | zstd -q -c -${RESULTS_ZSTD_LEVEL:-10} -T0 | base64 -w 0
+  else
+    tar zcf - "$@" | base64 -w 0
+  fi
+}
+
 # Try to find the actual files and use them
 if ls ${SUT_NAME}_stats.csv 1> /dev/null 2>&1; then
     # Using original SUT name for files
@@ -49,9 +59,9 @@ elif ls ${SANITIZED_SUT_NAME}_stats.csv 1> /dev/null 2>&1; then
 else
     # No stats files found, creating empty tar
     echo "No results generated" > no_results.txt
-    tar zcf - no_results.txt errors.log | base64 -w 0
+    archive_results no_results.txt errors.log
     exit 0
 fi
 
 # Tar and base64 encode the results so they can get pulled by the deployer with prefix: $FILE_PREFIX"
-tar zcf - ${FILE_PREFIX}_stats.csv ${FILE_PREFIX}_failures.csv ${FILE_PREFIX}_stats_history.csv errors.log | base64 -w 0
\ No newline at end of file
+archive_results ${FILE_PREFIX}_stats.csv ${FILE_PREFIX}_failures.csv ${FILE_PREFIX}_stats_history.csv errors.log
\ No newline at end of file